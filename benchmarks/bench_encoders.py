@@ -0,0 +1,140 @@
+"""Benchmark the JSON encoders on a synthetic large report.
+
+Each encoder runs in a separate process, so that peak memory usage can be
+measured independently. Example:
+
+    $ python benchmarks/bench_encoders.py --tests 100000
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from pytest_jsonreport.encoders import ENCODERS
+from pytest_jsonreport.writer import dump_report
+
+
+def make_stage(i, when, failed):
+    stage = {
+        'duration': 0.000123 * i,
+        'outcome': 'failed' if failed else 'passed',
+    }
+    if when == 'call':
+        stage['stdout'] = 'output line of test {}\n'.format(i) * 5
+        stage['log'] = [{
+            'name': 'root',
+            'msg': 'log message {} of test {}'.format(n, i),
+            'args': None,
+            'levelname': 'INFO',
+            'levelno': 20,
+            'pathname': '/path/to/tests/test_module_{}.py'.format(i % 100),
+            'filename': 'test_module_{}.py'.format(i % 100),
+            'module': 'test_module_{}'.format(i % 100),
+            'exc_info': None,
+            'lineno': 42,
+            'funcName': 'test_{}'.format(i),
+            'created': 1519772464.291738,
+            'msecs': 291.73803329467773,
+            'thread': 140671803118912,
+            'threadName': 'MainThread',
+            'process': 31481,
+        } for n in range(3)]
+    if failed:
+        loc = {'path': '/path/to/tests/test_module.py', 'lineno': 54,
+               'message': 'AssertionError: assert 1 == 2'}
+        stage['crash'] = loc
+        stage['traceback'] = [loc] * 3
+        stage['longrepr'] = 'def test_foo():\n>       assert 1 == 2\n' * 50
+    return stage
+
+
+def make_report(num_tests, failure_rate):
+    tests = []
+    for i in range(num_tests):
+        failed = failure_rate and i % int(1 / failure_rate) == 0
+        nodeid = 'tests/test_module_{}.py::TestClass::test_{}[param-{}]'.format(
+            i % 100, i, i % 7)
+        test = {
+            'nodeid': nodeid,
+            'lineno': i % 500,
+            'outcome': 'failed' if failed else 'passed',
+            'keywords': [nodeid.split('::')[-1], 'TestClass',
+                         'test_module_{}.py'.format(i % 100), 'tests'],
+        }
+        for when in ('setup', 'call', 'teardown'):
+            test[when] = make_stage(i, when, failed and when == 'call')
+        tests.append(test)
+    return {
+        'created': time.time(),
+        'duration': 123.4,
+        'exitcode': 1,
+        'root': '/path/to/tests',
+        'environment': {'Python': sys.version},
+        'summary': {'total': num_tests},
+        'tests': tests,
+    }
+
+
+def run_one(name, args):
+    report = make_report(args.tests, args.failure_rate)
+    encoder = ENCODERS[name]() if name != 'json.dump' else None
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'report.json')
+        start = time.perf_counter()
+        if encoder is None:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, default=str, indent=args.indent)
+        else:
+            with open(path, 'wb') as f:
+                dump_report(report, f, indent=args.indent, encoder=encoder)
+        elapsed = time.perf_counter() - start
+        size = os.path.getsize(path)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # `ru_maxrss` is in kilobytes on Linux, but in bytes on macOS
+    unit = 1 if sys.platform == 'darwin' else 1024
+    print(json.dumps({
+        'time': elapsed,
+        'peak_mem': (peak_rss - base_rss) * unit,
+        'size': size,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tests', type=int, default=20000,
+                        help='number of tests in the report')
+    parser.add_argument('--failure-rate', type=float, default=0.1)
+    parser.add_argument('--indent', type=int)
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run:
+        run_one(args.run, args)
+        return
+
+    print('{:<10} {:>10} {:>16} {:>12}'.format(
+        'encoder', 'time (s)', 'peak mem (MiB)', 'size (MiB)'))
+    for name in ['json.dump'] + list(ENCODERS):
+        if name not in ('json.dump', 'stdlib'):
+            try:
+                ENCODERS[name]()
+            except ImportError:
+                print('{:<10} (not installed)'.format(name))
+                continue
+        cmd = [sys.executable, __file__, '--run', name,
+               '--tests', str(args.tests),
+               '--failure-rate', str(args.failure_rate)]
+        if args.indent is not None:
+            cmd += ['--indent', str(args.indent)]
+        result = json.loads(subprocess.check_output(cmd))
+        print('{:<10} {:>10.3f} {:>16.1f} {:>12.1f}'.format(
+            name, result['time'], result['peak_mem'] / 2 ** 20,
+            result['size'] / 2 ** 20))
+
+
+if __name__ == '__main__':
+    main()
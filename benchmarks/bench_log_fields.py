@@ -0,0 +1,64 @@
+"""Benchmark the full vs. compact log record schema on a log-heavy suite.
+
+A synthetic test suite is generated and run with each log field selection.
+Example:
+
+    $ python benchmarks/bench_log_fields.py --tests 1000 --records 100
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+import time
+
+TEST_FILE = '''
+import logging
+import pytest
+
+logger = logging.getLogger('bench')
+
+@pytest.mark.parametrize('n', range({tests}))
+def test_logging(n):
+    for i in range({records}):
+        logger.info('record %d of test %d', i, n)
+'''
+
+
+def run(tmpdir, fields):
+    report_path = os.path.join(tmpdir, 'report.json')
+    cmd = [sys.executable, '-m', 'pytest', '-q', '-p', 'no:cacheprovider',
+           '--log-level=INFO', '--json-report',
+           '--json-report-file=' + report_path,
+           '--json-report-log-fields'] + fields
+    start = time.perf_counter()
+    subprocess.run(cmd, cwd=tmpdir, check=True, stdout=subprocess.DEVNULL)
+    elapsed = time.perf_counter() - start
+    return elapsed, os.path.getsize(report_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tests', type=int, default=1000,
+                        help='number of tests in the suite')
+    parser.add_argument('--records', type=int, default=100,
+                        help='number of log records per test')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with open(os.path.join(tmpdir, 'test_bench.py'), 'w') as f:
+            f.write(textwrap.dedent(TEST_FILE.format(
+                tests=args.tests, records=args.records)))
+        num_records = args.tests * args.records
+        print('{:<10} {:>10} {:>14} {:>12}'.format(
+            'fields', 'time (s)', 'records/s', 'size (MiB)'))
+        for fields in (['full'], ['compact']):
+            elapsed, size = run(tmpdir, fields)
+            print('{:<10} {:>10.2f} {:>14.0f} {:>12.1f}'.format(
+                ' '.join(fields), elapsed, num_records / elapsed,
+                size / 2 ** 20))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""Benchmark the overhead of the plugin on synthetic test suites.
+
+A synthetic test suite is generated for each size and run with and without
+the plugin (and with each number of xdist workers). The wall time overhead,
+the peak memory usage of the largest process and the report size are
+printed. Example:
+
+    $ python benchmarks/bench_overhead.py --tests 1000 10000 100000 \\
+        --log-records 10 --stdout-lines 10 --failure-rate 0.05 --workers 0 4
+
+Extra arguments for the plugin can be passed with `--report-args`, e.g.
+`--report-args="--json-report-summary"`.
+"""
+import argparse
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import textwrap
+import time
+
+TEST_FILE = '''
+import logging
+import pytest
+
+logger = logging.getLogger('bench')
+
+@pytest.mark.parametrize('n', range({tests}))
+def test_bench(n):
+    for i in range({stdout_lines}):
+        print('output line', i, 'of test', n)
+    for i in range({log_records}):
+        logger.info('record %d of test %d', i, n)
+    # Spreads the failures evenly over the suite
+    assert int((n + 1) * {failure_rate}) == int(n * {failure_rate})
+'''
+
+
+def run(tmpdir, workers, report_args):
+    """Run the suite in `tmpdir` and return the wall time, the peak memory
+    usage in bytes and the report size (or None if run without the
+    plugin)."""
+    cmd = [sys.executable, '-m', 'pytest', '-q', '-p', 'no:cacheprovider',
+           '--log-level=INFO']
+    if workers:
+        cmd += ['-n', str(workers)]
+    report_path = os.path.join(tmpdir, 'report.json')
+    if report_args is None:
+        cmd += ['-p', 'no:pytest_jsonreport']
+    else:
+        cmd += ['--json-report', '--json-report-file=' + report_path] + \
+            report_args
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=tmpdir, stdout=subprocess.DEVNULL)
+    # Unlike `proc.wait()`, this returns the resource usage of the process
+    # (including the xdist workers it waited for)
+    _, status, rusage = os.wait4(proc.pid, 0)
+    elapsed = time.perf_counter() - start
+    if os.WIFSIGNALED(status):
+        proc.returncode = -os.WTERMSIG(status)
+    else:
+        proc.returncode = os.WEXITSTATUS(status)
+    # Exit code 1 means that some tests failed
+    if proc.returncode not in (0, 1):
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+    # `ru_maxrss` is in kilobytes on Linux, but in bytes on macOS
+    unit = 1 if sys.platform == 'darwin' else 1024
+    size = None
+    if report_args is not None:
+        size = os.path.getsize(report_path)
+        os.remove(report_path)
+    return elapsed, rusage.ru_maxrss * unit, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tests', type=int, nargs='+', default=[1000],
+                        help='numbers of tests in the suites')
+    parser.add_argument('--log-records', type=int, default=0,
+                        help='number of log records per test')
+    parser.add_argument('--stdout-lines', type=int, default=0,
+                        help='number of stdout lines per test')
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                        help='fraction of failing tests')
+    parser.add_argument('--workers', type=int, nargs='+', default=[0],
+                        help='numbers of xdist workers (0 runs without '
+                        'xdist)')
+    parser.add_argument('--report-args', default='',
+                        help='extra arguments for the plugin')
+    args = parser.parse_args()
+    report_args = shlex.split(args.report_args)
+
+    print('{:>8} {:>8} {:>10} {:>10} {:>10} {:>12} {:>12} {:>11}'.format(
+        'tests', 'workers', 'base (s)', 'json (s)', 'overhead',
+        'base (MiB)', 'json (MiB)', 'size (MiB)'))
+    for tests in args.tests:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with open(os.path.join(tmpdir, 'test_bench.py'), 'w') as f:
+                f.write(textwrap.dedent(TEST_FILE.format(
+                    tests=tests, log_records=args.log_records,
+                    stdout_lines=args.stdout_lines,
+                    failure_rate=args.failure_rate)))
+            for workers in args.workers:
+                base_time, base_mem, _ = run(tmpdir, workers, None)
+                json_time, json_mem, size = run(tmpdir, workers, report_args)
+                print('{:>8} {:>8} {:>10.2f} {:>10.2f} {:>9.1f}% {:>12.1f} '
+                      '{:>12.1f} {:>11.1f}'.format(
+                          tests, workers, base_time, json_time,
+                          (json_time / base_time - 1) * 100,
+                          base_mem / 2 ** 20, json_mem / 2 ** 20,
+                          size / 2 ** 20))
+
+
+if __name__ == '__main__':
+    main()
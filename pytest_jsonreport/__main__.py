@@ -0,0 +1,75 @@
+"""Command line tools for JSON reports.
+
+Run `python -m pytest_jsonreport --help` for usage.
+"""
+import argparse
+import sys
+
+from .columnar import export_reports
+from .encoders import ENCODERS, get_encoder
+from .merge import merge_reports
+from .writer import atomic_report_file, make_dirs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m pytest_jsonreport',
+        description='Tools for reports of pytest-json-report.')
+    subparsers = parser.add_subparsers(dest='command', metavar='COMMAND')
+    subparsers.required = True
+
+    merge_parser = subparsers.add_parser(
+        'merge', help='merge multiple reports into one',
+        description='Merge multiple reports into one. If a test occurs in '
+        'more than one report, the one from the last report wins.')
+    merge_parser.add_argument(
+        'reports', nargs='+', metavar='REPORT',
+        help='report to merge (documents, streamed, compact or compressed)')
+    merge_parser.add_argument(
+        '-o', '--output', required=True, metavar='PATH',
+        help='where to save the merged report (compressed if the file name '
+        'ends with .gz, .bz2 or .xz)')
+    merge_parser.add_argument(
+        '--indent', type=int, metavar='N',
+        help='pretty-print the merged report with the given indent level')
+    merge_parser.add_argument(
+        '--compact', default=False, action='store_true',
+        help='save the merged report in the compact format')
+    merge_parser.add_argument(
+        '--encoder', default='stdlib', choices=['auto'] + list(ENCODERS),
+        help='JSON encoder to use (default: stdlib)')
+    merge_parser.set_defaults(func=_merge)
+
+    columnar_parser = subparsers.add_parser(
+        'columnar', help='export test outcomes and durations as columnar '
+        'arrays', description='Export the outcomes and stage durations of '
+        'the tests in one or more reports as columnar arrays to a NumPy .npz '
+        'archive, with one run per report.')
+    columnar_parser.add_argument(
+        'reports', nargs='+', metavar='REPORT', help='report to export')
+    columnar_parser.add_argument(
+        '-o', '--output', required=True, metavar='PATH',
+        help='where to save the .npz archive')
+    columnar_parser.set_defaults(func=_columnar)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+def _merge(args):
+    make_dirs(args.output)
+    with atomic_report_file(args.output) as f:
+        merge_reports(args.reports, f, indent=args.indent,
+                      encoder=get_encoder(args.encoder),
+                      compact=args.compact)
+    return 0
+
+
+def _columnar(args):
+    make_dirs(args.output)
+    export_reports(args.reports, args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
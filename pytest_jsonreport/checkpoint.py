@@ -0,0 +1,122 @@
+"""Periodic checkpoints of the report of a running session.
+
+A checkpoint is a report document of the tests finished so far, which is
+saved to the report path from a background thread, so that a partial report
+is left behind if the session never finishes (e.g. when a CI job times out).
+The `exitcode` of a checkpoint is null. The final report replaces the last
+checkpoint.
+"""
+from collections import OrderedDict
+import tempfile
+import threading
+
+from .encoders import StdlibEncoder
+from .writer import Encoded, atomic_report_file, dump_report, make_dirs
+
+
+class Checkpointer:
+    """Save checkpoints of a report periodically.
+
+    Finished tests are added with `add_test()`, which just hands them over
+    to the background thread. Each test is only encoded once per change, and
+    the encoded tests are kept in a temporary file (not in memory) and reused
+    for later checkpoints. If nothing changed since the last checkpoint, none
+    is saved. The interval is counted from the end of the last checkpoint, so
+    saving never runs back to back.
+
+    The report path, interval (in seconds), indentation and whether only the
+    summary is saved are taken from the options of `config`.
+    `make_report(outcomes, tests)` is called from the background thread to
+    create the report from the outcomes and the JSON test items of the
+    finished tests. It must copy what the plugin keeps changing (e.g. the
+    collectors and warnings), and may leave out the tests if only the summary
+    is saved.
+    """
+
+    def __init__(self, config, make_report, encoder=None):
+        option = config.option
+        self._path = option.json_report_file
+        self._interval = option.json_report_checkpoint_interval
+        self._make_report = make_report
+        self._encoder = encoder or StdlibEncoder()
+        self._indent = option.json_report_indent
+        self._details = not option.json_report_summary
+        self._fsync = option.json_report_fsync
+        self._lock = threading.Lock()
+        # Node ID -> test items which changed since the last checkpoint
+        self._pending = OrderedDict()
+        # Node ID -> outcome of all finished tests
+        self._outcomes = OrderedDict()
+        # Node ID -> offset and length of the encoded test items of all
+        # finished tests in `_file`, so that they aren't held in memory
+        self._encoded = OrderedDict()
+        # pylint: disable=consider-using-with
+        self._file = tempfile.TemporaryFile() if self._details else None
+        self._size = 0
+        # Numbers of tests, collectors, failures and warnings in the last
+        # checkpoint
+        self._saved = None
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name='json-report-checkpoint', daemon=True)
+        make_dirs(self._path)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread, waiting for a running checkpoint to
+        be saved."""
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        if self._file is not None:
+            self._file.close()
+
+    def add_test(self, json_testitem):
+        """Add the finished JSON `json_testitem` to the next checkpoint."""
+        # The item may still change if the test is rerun, so the checkpoint
+        # gets a copy. Stages are replaced rather than changed.
+        with self._lock:
+            self._pending[json_testitem['nodeid']] = dict(json_testitem)
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            try:
+                self.save()
+            # The final report will run into the same error and report it
+            except OSError:
+                continue
+
+    def save(self):
+        """Save a checkpoint (unless nothing changed since the last one)."""
+        with self._lock:
+            pending, self._pending = self._pending, OrderedDict()
+        for nodeid, json_testitem in pending.items():
+            self._outcomes[nodeid] = json_testitem['outcome']
+            if self._details:
+                self._add_encoded(nodeid, self._encoder.dumps(
+                    json_testitem, indent=self._indent))
+        report = self._make_report(self._outcomes.values(),
+                                   self._encoded_tests())
+        saved = (len(self._outcomes),) + tuple(
+            len(report.get(key, ())) for key in
+            ('collectors', 'failures', 'warnings'))
+        if not pending and saved == self._saved:
+            return
+        with atomic_report_file(self._path, self._fsync) as f:
+            dump_report(report, f, indent=self._indent, encoder=self._encoder)
+        self._saved = saved
+
+    def _add_encoded(self, nodeid, data):
+        # A rerun test is appended again, its earlier item is left unused
+        self._file.seek(self._size)
+        self._file.write(data)
+        self._encoded[nodeid] = (self._size, len(data))
+        self._size += len(data)
+
+    def _encoded_tests(self):
+        """Yield the encoded test items of the finished tests."""
+        for offset, length in self._encoded.values():
+            self._file.seek(offset)
+            yield Encoded(self._file.read(length))
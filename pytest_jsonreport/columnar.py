@@ -0,0 +1,187 @@
+"""Columnar export of test outcomes and durations.
+
+The export is a NumPy `.npz` archive with one array per column, which can be
+loaded with `numpy.load()` for vectorized analyses. It's written with the
+stdlib only, so NumPy isn't required (use `load_columns()` to read an export
+without NumPy). Each row is one test of one run:
+
+| Column | Type | Description |
+| --- | --- | --- |
+| `run` | uint32 | Index into `runs` |
+| `nodeid` | int32 | Index into `nodeids` |
+| `outcome` | uint8 | Index into `outcomes` |
+| `setup`, `call`, `teardown` | float64 | Stage durations (NaN if missing) |
+| `start` | float64 | Start of the test as Unix time (NaN if unknown) |
+
+`runs` holds the start times of the sessions, and `nodeids` and `outcomes`
+the unique node IDs and outcomes.
+"""
+from array import array
+import ast
+import sys
+import zipfile
+
+from .reader import iter_records
+from .serialize import STAGES
+from .writer import atomic_report_file
+
+NAN = float('nan')
+
+# Array type codes by NumPy type
+_TYPECODES = {'<u4': 'I', '<i4': 'i', '|u1': 'B', '<f8': 'd'}
+
+_MAGIC = b'\x93NUMPY\x01\x00'
+
+
+class Columns:
+    """Columns of test outcomes and durations of one or more runs."""
+
+    def __init__(self):
+        self.runs = array('d')
+        self.nodeids = []
+        self.outcomes = []
+        self.columns = {
+            'run': array('I'),
+            'nodeid': array('i'),
+            'outcome': array('B'),
+            'setup': array('d'),
+            'call': array('d'),
+            'teardown': array('d'),
+            'start': array('d'),
+        }
+        self._nodeid_codes = {}
+        self._outcome_codes = {}
+        # (run, node ID) -> row, for replacing rows of rerun tests
+        self._rows = {}
+        # Node ID -> start time of tests which are still running
+        self._starts = {}
+
+    def __len__(self):
+        return len(self.columns['run'])
+
+    def add_run(self, start=None):
+        """Add a run (session) and return its index."""
+        self.runs.append(NAN if start is None else start)
+        return len(self.runs) - 1
+
+    def set_start(self, nodeid, start):
+        """Set the start time of the test `nodeid`, which is added later."""
+        if start is not None:
+            self._starts[nodeid] = start
+
+    def has_test(self, nodeid, run=0):
+        return (run, nodeid) in self._rows
+
+    def add_test(self, test, run=0, start=None):
+        """Add (or replace) the row of the JSON `test` item in `run`."""
+        nodeid = test['nodeid']
+        if start is None:
+            start = self._starts.pop(nodeid, None)
+        values = {
+            'run': run,
+            'nodeid': _code(nodeid, self.nodeids, self._nodeid_codes),
+            'outcome': _code(test['outcome'], self.outcomes,
+                             self._outcome_codes),
+            'start': NAN if start is None else start,
+        }
+        for when in STAGES:
+            values[when] = test[when].get('duration', NAN) if \
+                when in test else NAN
+        row = self._rows.get((run, nodeid))
+        if row is None:
+            self._rows[(run, nodeid)] = len(self)
+            for name, column in self.columns.items():
+                column.append(values[name])
+        else:
+            for name, column in self.columns.items():
+                column[row] = values[name]
+
+    def save(self, path, fsync=False):
+        """Save the columns as `.npz` archive to `path` (see
+        `writer.atomic_report_file()` for `fsync`)."""
+        arrays = dict(self.columns, runs=self.runs,
+                      nodeids=self.nodeids, outcomes=self.outcomes)
+        with atomic_report_file(path, fsync) as f, \
+                zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for name, values in arrays.items():
+                archive.writestr(name + '.npy', _npy(values))
+
+
+def export_reports(paths, path):
+    """Export the tests of the reports at `paths` to the `.npz` archive at
+    `path`, with one run per report."""
+    columns = Columns()
+    for report_path in paths:
+        run = columns.add_run()
+        for type_, record in iter_records(report_path):
+            if type_ == 'test':
+                columns.add_test(record, run)
+            elif type_ == 'header':
+                columns.runs[run] = record['start']
+            elif type_ == 'summary' and 'created' in record:
+                columns.runs[run] = record['created'] - record.get(
+                    'duration', 0)
+    columns.save(path)
+    return columns
+
+
+def load_columns(path):
+    """Load the `.npz` archive at `path` without NumPy.
+
+    Returns a dict of column names to `array.array` objects (or lists, for
+    strings).
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as f:
+        for name in f.namelist():
+            arrays[name[:-len('.npy')]] = _parse_npy(f.read(name))
+    return arrays
+
+
+def _code(value, values, codes):
+    try:
+        return codes[value]
+    except KeyError:
+        codes[value] = len(values)
+        values.append(value)
+        return codes[value]
+
+
+def _npy(values):
+    """Return `values` (an array or a list of strings) in the `.npy`
+    format."""
+    if isinstance(values, array):
+        descr = next(descr for descr, typecode in _TYPECODES.items() if
+                     typecode == values.typecode)
+        if sys.byteorder == 'big':
+            values = array(values.typecode, values)
+            values.byteswap()
+        data = values.tobytes()
+    else:
+        # Fixed-width UTF-32 strings
+        width = max([len(s) for s in values] or [1])
+        descr = '<U{}'.format(width)
+        data = b''.join(s.encode('utf-32-le').ljust(width * 4, b'\0') for
+                        s in values)
+    header = "{{'descr': '{}', 'fortran_order': False, 'shape': ({},), }}" \
+        .format(descr, len(values))
+    # Pad the header so that the data is aligned to 64 bytes
+    header += ' ' * (-(len(_MAGIC) + 2 + len(header) + 1) % 64) + '\n'
+    return b''.join([_MAGIC, len(header).to_bytes(2, 'little'),
+                     header.encode('latin1'), data])
+
+
+def _parse_npy(data):
+    header_len = int.from_bytes(data[8:10], 'little')
+    header = ast.literal_eval(data[10:10 + header_len].decode('latin1'))
+    data = data[10 + header_len:]
+    descr = header['descr']
+    if descr.startswith('<U'):
+        width = int(descr[2:]) * 4
+        return [data[i:i + width].decode('utf-32-le').rstrip('\0') for
+                i in range(0, len(data), width)]
+    values = array(_TYPECODES[descr])
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
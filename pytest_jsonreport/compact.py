@@ -0,0 +1,194 @@
+"""Compact report format with a string table.
+
+In a compact report, strings which tend to repeat throughout a report (node
+ID prefixes, keywords, outcomes, file paths, log record fields, ...) are
+replaced with integer references into a table of unique strings. The table
+is stored under the `strings` key of the report. Test node IDs are stored as
+a list of the reference to their parent's node ID (everything up to the last
+"::") and the remaining name.
+
+In a streamed report, new strings are written as `strings` records before the
+first record which references them.
+"""
+from .serialize import STAGES
+
+# Log record fields which are interned
+LOG_STRING_FIELDS = ('name', 'levelname', 'pathname', 'filename', 'module',
+                     'funcName', 'threadName', 'processName')
+
+
+class StringTable:
+    """Table of unique strings."""
+
+    def __init__(self, strings=None):
+        self.strings = list(strings or [])
+        self._refs = {s: i for i, s in enumerate(self.strings)}
+
+    def ref(self, s):
+        """Return the reference to `s`, adding it to the table if needed."""
+        if not isinstance(s, str):
+            return s
+        try:
+            return self._refs[s]
+        except KeyError:
+            ref = self._refs[s] = len(self.strings)
+            self.strings.append(s)
+            return ref
+
+    def nodeid_ref(self, nodeid):
+        """Return the compact representation of `nodeid`."""
+        if not isinstance(nodeid, str):
+            return nodeid
+        parent, sep, name = nodeid.rpartition('::')
+        if not sep:
+            return self.ref(nodeid)
+        return [self.ref(parent), name]
+
+
+class _Strings:
+    """Resolver for references into a list of `strings`."""
+
+    def __init__(self, strings):
+        self.strings = strings
+
+    def ref(self, ref):
+        if not isinstance(ref, int) or isinstance(ref, bool):
+            return ref
+        return self.strings[ref]
+
+    def nodeid_ref(self, ref):
+        if isinstance(ref, list):
+            return '{}::{}'.format(self.strings[ref[0]], ref[1])
+        return self.ref(ref)
+
+
+def compact_report(report):
+    """Return a compact version of `report`.
+
+    The lists of the returned report are iterators which compact the items
+    of `report` only as they're consumed, so it's meant to be written with
+    `writer.dump_report()` (which writes the string table last).
+    """
+    table = StringTable()
+    compact = dict(report)
+    for key, type_ in (('collectors', 'collector'), ('tests', 'test'),
+                       ('warnings', 'warning')):
+        if key in compact:
+            compact[key] = _compact_items(report[key], type_, table)
+    if 'failures' in compact:
+        compact['failures'] = {
+            failure_id: _transform_failure(failure, table) for
+            failure_id, failure in report['failures'].items()}
+    # The table is filled while the report is being written
+    compact['strings'] = table.strings
+    return compact
+
+
+def _compact_items(items, type_, table):
+    for item in items:
+        yield compact_record(type_, item, table)
+
+
+def expand_report(report):
+    """Return the standard version of the compact `report`.
+
+    Reports which aren't compact are returned unchanged.
+    """
+    if 'strings' not in report:
+        return report
+    expanded = dict(report)
+    strings = expanded.pop('strings')
+    for key, type_ in (('collectors', 'collector'), ('tests', 'test'),
+                       ('warnings', 'warning')):
+        if key in expanded:
+            expanded[key] = [expand_record(type_, item, strings) for item in
+                             expanded[key]]
+    if 'failures' in expanded:
+        expanded['failures'] = {
+            failure_id: _transform_failure(failure, _Strings(strings)) for
+            failure_id, failure in expanded['failures'].items()}
+    return expanded
+
+
+def compact_record(type_, record, table):
+    """Return the compact version of a `record` of type `type_` (e.g.
+    "test"), adding new strings to `table`."""
+    return _TRANSFORMS.get(type_, _identity)(record, table)
+
+
+def expand_record(type_, record, strings):
+    """Return the standard version of a compact `record` of type `type_`
+    using the string table `strings`."""
+    return _TRANSFORMS.get(type_, _identity)(record, _Strings(strings))
+
+
+def _identity(record, table):
+    return record
+
+
+def _transform_test(test, table):
+    test = dict(test)
+    test['nodeid'] = table.nodeid_ref(test['nodeid'])
+    test['outcome'] = table.ref(test['outcome'])
+    if 'keywords' in test:
+        test['keywords'] = [table.ref(k) for k in test['keywords']]
+    for when in STAGES:
+        if when in test:
+            test[when] = _transform_stage(test[when], table)
+    return test
+
+
+def _transform_stage(stage, table):
+    stage = _transform_failure(stage, table)
+    if 'outcome' in stage:
+        stage['outcome'] = table.ref(stage['outcome'])
+    if 'log' in stage:
+        stage['log'] = [_transform_log_record(r, table) for r in stage['log']]
+    return stage
+
+
+def _transform_failure(failure, table):
+    failure = dict(failure)
+    if 'crash' in failure:
+        failure['crash'] = dict(failure['crash'],
+                                path=table.ref(failure['crash']['path']))
+    if 'traceback' in failure:
+        failure['traceback'] = [
+            dict(entry, path=table.ref(entry['path']),
+                 message=table.ref(entry['message'])) for
+            entry in failure['traceback']]
+    return failure
+
+
+def _transform_log_record(record, table):
+    record = dict(record)
+    for key in LOG_STRING_FIELDS:
+        if key in record:
+            record[key] = table.ref(record[key])
+    return record
+
+
+def _transform_collector(collector, table):
+    collector = dict(collector)
+    collector['nodeid'] = table.nodeid_ref(collector['nodeid'])
+    collector['outcome'] = table.ref(collector['outcome'])
+    collector['result'] = [
+        dict(item, nodeid=table.nodeid_ref(item['nodeid']),
+             type=table.ref(item['type'])) for item in collector['result']]
+    return collector
+
+
+def _transform_warning(warning, table):
+    warning = dict(warning)
+    for key in ('category', 'filename', 'when'):
+        if key in warning:
+            warning[key] = table.ref(warning[key])
+    return warning
+
+
+_TRANSFORMS = {
+    'test': _transform_test,
+    'collector': _transform_collector,
+    'warning': _transform_warning,
+    'failure': _transform_failure,
+}
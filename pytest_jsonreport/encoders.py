@@ -0,0 +1,194 @@
+"""JSON encoder backends.
+
+All encoders produce UTF-8 encoded JSON and convert values which aren't
+JSON-serializable with `str()`. The output of third-party encoders may differ
+in whitespace from the output of the stdlib `json` module.
+"""
+from collections import OrderedDict
+from enum import Enum
+import json
+import math
+import warnings
+
+
+class StdlibEncoder:
+    """Encoder using the stdlib `json` module."""
+
+    name = 'stdlib'
+
+    def dumps(self, obj, indent=None):
+        """Return `obj` encoded as JSON bytes."""
+        return json.dumps(obj, default=str, indent=indent).encode('utf-8')
+
+    def loads(self, data):
+        return json.loads(data.decode('utf-8'))
+
+    def serializable(self, obj):
+        """Return whether `obj` is JSON-serializable."""
+        result = _check_types(obj)
+        if result is not None:
+            return result
+        try:
+            json.dumps(obj)
+        except (TypeError, OverflowError, ValueError):
+            return False
+        return True
+
+
+class OrjsonEncoder(StdlibEncoder):
+    """Encoder using `orjson`.
+
+    Only indentation with 2 spaces is supported by orjson, so other indent
+    levels are handled by the stdlib encoder. So are values which orjson
+    encodes differently: enums (other than `IntEnum` and the like), which it
+    encodes by value, and non-finite floats, which it encodes as null.
+    """
+
+    name = 'orjson'
+
+    def __init__(self):
+        # pylint: disable=import-outside-toplevel,import-error
+        import orjson
+        self._orjson = orjson
+        # Use `str()` for dataclasses and datetimes like the stdlib encoder
+        self._option = orjson.OPT_NON_STR_KEYS | \
+            orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def dumps(self, obj, indent=None):
+        if indent not in (None, 2) or _has_orjson_values(obj):
+            return StdlibEncoder.dumps(self, obj, indent)
+        option = self._option
+        if indent:
+            option |= self._orjson.OPT_INDENT_2
+        try:
+            return self._orjson.dumps(obj, default=str, option=option)
+        # Raised for data the stdlib encoder can handle, but orjson can't,
+        # e.g. integers exceeding 64 bits
+        except TypeError:
+            return StdlibEncoder.dumps(self, obj, indent)
+
+    def loads(self, data):
+        return self._orjson.loads(data)
+
+    def serializable(self, obj):
+        if _has_orjson_values(obj):
+            return StdlibEncoder.serializable(self, obj)
+        try:
+            self._orjson.dumps(obj, option=self._option)
+        except TypeError:
+            return StdlibEncoder.serializable(self, obj)
+        return True
+
+
+class UjsonEncoder(StdlibEncoder):
+    """Encoder using `ujson`."""
+
+    name = 'ujson'
+
+    def __init__(self):
+        # pylint: disable=import-outside-toplevel,import-error
+        import ujson
+        self._ujson = ujson
+
+    def dumps(self, obj, indent=None):
+        try:
+            return self._ujson.dumps(
+                obj, default=str, indent=indent or 0,
+                escape_forward_slashes=False).encode('utf-8')
+        except (TypeError, OverflowError):
+            return StdlibEncoder.dumps(self, obj, indent)
+
+    def loads(self, data):
+        return self._ujson.loads(data)
+
+
+# Available encoders, in order of preference for "auto"
+ENCODERS = OrderedDict([
+    ('orjson', OrjsonEncoder),
+    ('ujson', UjsonEncoder),
+    ('stdlib', StdlibEncoder),
+])
+
+
+def get_encoder(name='stdlib'):
+    """Return an instance of the encoder called `name`.
+
+    The name "auto" selects the fastest encoder available. If the requested
+    encoder isn't installed, a warning is issued and the stdlib encoder is
+    used instead.
+    """
+    if name == 'auto':
+        for cls in ENCODERS.values():
+            try:
+                return cls()
+            except ImportError:
+                continue
+    try:
+        return ENCODERS[name]()
+    except ImportError:
+        warnings.warn('JSON encoder "{}" is not installed, falling back to '
+                      'stdlib encoder'.format(name))
+        return StdlibEncoder()
+
+
+# Types which `json.dumps()` encodes without converting them, checked by
+# identity first since that's the common case and faster than `isinstance()`
+_SCALAR_TYPES = frozenset([str, int, float, bool, type(None)])
+_SCALARS = (str, int, float, type(None))
+
+
+def _has_orjson_values(obj):
+    """Return whether `obj` contains values which orjson encodes differently
+    from the stdlib `json` module (see `OrjsonEncoder`)."""
+    stack = [obj]
+    seen = set()
+    while stack:
+        obj = stack.pop()
+        type_ = type(obj)
+        if type_ in _SCALAR_TYPES and type_ is not float:
+            continue
+        if isinstance(obj, float):
+            if not math.isfinite(obj):
+                return True
+        elif isinstance(obj, (dict, list, tuple)):
+            # Shared or circular references are only walked once
+            if id(obj) in seen:
+                continue
+            seen.add(id(obj))
+            stack.extend(obj.values() if isinstance(obj, dict) else obj)
+        elif isinstance(obj, Enum) and not isinstance(obj, _SCALARS):
+            return True
+    return False
+
+
+def _check_types(obj):
+    """Return whether `json.dumps()` can encode `obj` by walking its types,
+    which is cheaper than encoding it.
+
+    Returns None if a list or dict occurs more than once, which is either a
+    shared reference or a circular one (which can't be encoded). Only
+    encoding can tell them apart.
+    """
+    stack = [obj]
+    seen = set()
+    while stack:
+        obj = stack.pop()
+        if type(obj) in _SCALAR_TYPES:
+            continue
+        if isinstance(obj, dict):
+            for key in obj:
+                if type(key) not in _SCALAR_TYPES and \
+                        not isinstance(key, _SCALARS):
+                    return False
+            values = obj.values()
+        elif isinstance(obj, (list, tuple)):
+            values = obj
+        elif isinstance(obj, _SCALARS):
+            continue
+        else:
+            return False
+        if id(obj) in seen:
+            return None
+        seen.add(id(obj))
+        stack.extend(values)
+    return True
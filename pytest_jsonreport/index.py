@@ -0,0 +1,174 @@
+"""Sidecar index for random access to the tests of a report.
+
+The index of the report at PATH is stored at PATH.idx. The first line of the
+index is a JSON object whose `report` key holds the size of the report file
+and a hash of its first bytes, so an index which doesn't belong to the
+current version of the report (e.g. when the report has been replaced by a
+checkpoint or a later session) is detected. Every other line is a JSON list
+`[nodeid, offset, length, outcome]` which locates a test item in the report
+file. These lines are sorted by node ID, so a test is found with a binary
+search which only touches a few lines of the index and the test item itself.
+
+Indexes are only supported for uncompressed report documents in the standard
+format.
+"""
+import hashlib
+import json
+import mmap
+import os
+
+from .store import EncodedTest
+from .writer import atomic_report_file
+
+INDEX_SUFFIX = '.idx'
+# Number of bytes at the start of a report which are hashed to identify it
+HEAD_SIZE = 4096
+
+
+def index_path(path):
+    """Return the path of the index of the report at `path`."""
+    return path + INDEX_SUFFIX
+
+
+class IndexBuilder:
+    """Collect the index entries of the tests written by
+    `writer.dump_report()`, which takes an instance as `on_item` callback."""
+
+    def __init__(self):
+        self.entries = []
+
+    def __call__(self, key, item, offset, length):
+        if key != 'tests':
+            return
+        if isinstance(item, EncodedTest):
+            self.entries.append((item.nodeid, offset, length, item.outcome))
+        else:
+            self.entries.append(
+                (item['nodeid'], offset, length, item['outcome']))
+
+    def save(self, path, fsync=False):
+        """Save the index of the report at `path` (see
+        `writer.atomic_report_file()` for `fsync`)."""
+        self.entries.sort()
+        with open(path, 'rb') as f:
+            header = {'report': _fingerprint(f)}
+        with atomic_report_file(index_path(path), fsync) as f:
+            f.write(json.dumps(header).encode() + b'\n')
+            for entry in self.entries:
+                f.write(json.dumps(list(entry)).encode() + b'\n')
+
+
+class ReportIndex:
+    """Look up tests of the report at `path` by node ID using its index.
+
+    The report and its index are memory-mapped, so lookups take logarithmic
+    time and only read the required parts of the files. Use it as a context
+    manager or call `close()` when done.
+
+    Raises a `ValueError` if the index doesn't belong to the current version
+    of the report.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            fingerprint = _fingerprint(f)
+            self._report_map = _map_file(f)
+        self._index_map = _map(index_path(path))
+        try:
+            header = json.loads(self._index_map.readline())
+        except (AttributeError, ValueError):
+            header = None
+        if not isinstance(header, dict) or \
+           header.get('report') != fingerprint:
+            self.close()
+            raise ValueError('The index of {} belongs to a different version '
+                             'of the report'.format(path))
+        # Offset of the first entry
+        self._start = self._index_map.tell()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for map_ in (self._report_map, self._index_map):
+            if map_ is not None:
+                map_.close()
+
+    def __contains__(self, nodeid):
+        return self._find(nodeid) is not None
+
+    def __getitem__(self, nodeid):
+        entry = self._find(nodeid)
+        if entry is None:
+            raise KeyError(nodeid)
+        _, offset, length, _ = entry
+        return json.loads(self._report_map[offset:offset + length])
+
+    def get(self, nodeid, default=None):
+        """Return the test item of `nodeid` or `default` if there is none."""
+        try:
+            return self[nodeid]
+        except KeyError:
+            return default
+
+    def outcome(self, nodeid):
+        """Return the outcome of the test `nodeid` without reading the test
+        item from the report."""
+        entry = self._find(nodeid)
+        if entry is None:
+            raise KeyError(nodeid)
+        return entry[3]
+
+    def nodeids(self):
+        """Iterate over the node IDs of all tests (in sorted order)."""
+        self._index_map.seek(self._start)
+        for line in iter(self._index_map.readline, b''):
+            yield json.loads(line)[0]
+
+    def _find(self, nodeid):
+        """Return the index entry of `nodeid` (or None) by binary search over
+        the lines of the index."""
+        map_ = self._index_map
+        # `lo` is always at the start of a line (the header ends with a
+        # newline right before the first entry)
+        lo, hi = self._start, len(map_)
+        while lo < hi:
+            start = map_.rfind(b'\n', self._start - 1, (lo + hi) // 2) + 1
+            end = map_.find(b'\n', start)
+            if end == -1:
+                end = len(map_)
+            entry = json.loads(map_[start:end])
+            if entry[0] < nodeid:
+                lo = end + 1
+            elif entry[0] > nodeid:
+                hi = start
+            else:
+                return entry
+        return None
+
+
+def _fingerprint(f):
+    """Return the size of the open report file `f` and a hash of its first
+    `HEAD_SIZE` bytes."""
+    size = os.fstat(f.fileno()).st_size
+    f.seek(0)
+    return [size, hashlib.sha1(f.read(HEAD_SIZE)).hexdigest()]
+
+
+def _map(path):
+    """Return a read-only memory map of the file at `path` (or None if the
+    file is empty, which can't be mapped)."""
+    with open(path, 'rb') as f:
+        return _map_file(f)
+
+
+def _map_file(f):
+    """Return a read-only memory map of the open file `f` (or None if the
+    file is empty)."""
+    try:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        return None
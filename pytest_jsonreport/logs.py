@@ -0,0 +1,147 @@
+"""Capturing of the log records of test stages."""
+from collections import OrderedDict, deque
+import logging
+
+from .serialize import LOG_FIELD_PRESETS
+
+
+class LoggingHandler(logging.Handler):
+    """Log handler which collects records in `records`.
+
+    Records are only collected while `records` is a list, i.e. while a test
+    stage is running. If `fields` is given, records are stored as tuples of
+    the values of these fields (see `serialize.make_log`), otherwise as dicts
+    of all attributes.
+
+    If `collapse` is "consecutive" (or "all"), consecutive (or all) records
+    with the same logger name, level and message are collapsed into the first
+    one. Repeats are only counted, and the count and the time of the last
+    repeat are added to the record as `repeat_count` and `last_created` when
+    collecting stops.
+    """
+
+    def __init__(self, level=logging.NOTSET, fields=None, max_records=None,
+                 collapse=None):
+        super().__init__(level)
+        self.records = None
+        self.fields = fields
+        if fields is not None:
+            self._getters = [_log_field_getter(field) for field in fields]
+        self._max_records = max_records
+        # Limit of the current stage (see `start()`)
+        self._limit = None
+        # If there are too many records, the last ones are kept in `_tail`
+        self._tail = None
+        self._num_dropped = 0
+        self._collapse = collapse
+        # Key -> [record, repeat count, time of last repeat] of the records
+        # which later records may be collapsed into
+        self._repeats = {}
+        # Repeat infos of the records which have been repeated
+        self._repeated = []
+
+    def start(self, max_records=None):
+        """Start collecting records, at most `max_records` (if given) in
+        addition to the limit of each stage."""
+        limit = self._max_records
+        if max_records is not None:
+            limit = max_records if limit is None else min(limit, max_records)
+        self._limit = limit
+        if limit is not None:
+            self._tail = deque(maxlen=limit // 2)
+        self._num_dropped = 0
+        self._repeats.clear()
+        del self._repeated[:]
+        self.records = []
+
+    def stop(self):
+        """Stop collecting records.
+
+        Return the records and the number of records dropped due to the
+        record limits.
+        """
+        records, self.records = self.records, None
+        if self._tail:
+            records.extend(self._tail)
+        if self._repeated:
+            records = self._add_repeats(records)
+        return records, self._num_dropped
+
+    def _add_repeats(self, records):
+        if self.fields is None:
+            for record, count, last_created in self._repeated:
+                record['repeat_count'] = count
+                record['last_created'] = last_created
+            return records
+        # Tuples are extended by the values (see `serialize.make_log`)
+        repeats = {id(record): (count, last_created) for
+                   record, count, last_created in self._repeated}
+        return [record + repeats[id(record)] if id(record) in repeats else
+                record for record in records]
+
+    def _add(self, records, entry):
+        if self._limit is None or \
+           len(records) < self._limit - self._tail.maxlen:
+            records.append(entry)
+            return
+        if len(self._tail) == self._tail.maxlen:
+            self._num_dropped += 1
+        self._tail.append(entry)
+
+    def handle(self, record):
+        # Bail out early without acquiring the handler lock
+        if self.records is None:
+            return False
+        return super().handle(record)
+
+    def emit(self, record):
+        records = self.records
+        if records is None:
+            return
+        if self._collapse is None:
+            self._add(records, self._make_entry(record))
+            return
+        key = (record.name, record.levelno, record.getMessage())
+        repeat = self._repeats.get(key)
+        if repeat is not None:
+            if repeat[1] == 1:
+                self._repeated.append(repeat)
+            repeat[1] += 1
+            repeat[2] = record.created
+            return
+        entry = self._make_entry(record)
+        self._add(records, entry)
+        if self._collapse == 'consecutive':
+            self._repeats.clear()
+        self._repeats[key] = [entry, 1, record.created]
+
+    def _make_entry(self, record):
+        if self.fields is not None:
+            return tuple(get(record) for get in self._getters)
+        d = dict(record.__dict__)
+        d['msg'] = record.getMessage()
+        d['args'] = None
+        d['exc_info'] = None
+        d.pop('message', None)
+        return d
+
+
+def _log_field_getter(field):
+    if field == 'msg':
+        return logging.LogRecord.getMessage
+    # These may hold arbitrary objects and are always left empty
+    if field in ('args', 'exc_info'):
+        return lambda record: None
+    return lambda record: getattr(record, field, None)
+
+
+def log_fields(names):
+    """Return the tuple of log record fields selected by `names` (attribute
+    names or presets), or None if all fields are selected."""
+    fields = []
+    for name in names:
+        if name == 'full':
+            return None
+        fields.extend(LOG_FIELD_PRESETS.get(name, [name]))
+    # Remove duplicates, but keep the order
+    return tuple(OrderedDict.fromkeys(fields))
@@ -0,0 +1,155 @@
+"""Merging of multiple reports into one.
+
+Reports are merged in two passes over the input files: The first pass
+determines which test items end up in the merged report and computes the
+summary, the second one writes the tests. Only the node IDs of the tests are
+kept in memory; collectors and warnings are spilled to temporary files.
+"""
+from collections import Counter, OrderedDict
+import tempfile
+
+from . import serialize
+from .compact import compact_report
+from .encoders import StdlibEncoder
+from .reader import iter_records
+from .writer import dump_report
+
+
+def merge_reports(paths, f, indent=None, encoder=None, compact=False):
+    """Merge the reports at `paths` and write the result to the binary file
+    `f`.
+
+    If the same test (by node ID) occurs more than once, the last occurrence
+    wins, i.e. the one from the report which comes last in `paths`. The same
+    goes for collectors. Warnings of all reports are kept. The summary is
+    recomputed from the outcomes of the merged tests, with the `collected`
+    and `deselected` counts of all reports added up.
+
+    The merged report is created when the last of the reports was created
+    and its duration spans all reports. The exit code is the highest one
+    among the reports, except that 5 (no tests collected) is only used if
+    it's the exit code of all reports.
+    """
+    encoder = encoder or StdlibEncoder()
+    collector_spill = _Spill(encoder)
+    warning_spill = _Spill(encoder)
+    tests, collectors, failures, infos = _scan_reports(
+        paths, collector_spill, warning_spill)
+    report = _merge_infos(
+        infos, Counter(outcome for _, _, outcome in tests.values()))
+    if collectors:
+        report['collectors'] = (
+            collector for i, collector in enumerate(collector_spill) if
+            collectors[collector['nodeid']] == i)
+    report['tests'] = _iter_merged_tests(paths, tests)
+    if failures:
+        report['failures'] = failures
+    if len(warning_spill):
+        report['warnings'] = iter(warning_spill)
+    if compact:
+        report = compact_report(report)
+    try:
+        dump_report(report, f, indent=indent, encoder=encoder)
+    finally:
+        collector_spill.close()
+        warning_spill.close()
+
+
+def _scan_reports(paths, collector_spill, warning_spill):
+    """Make the first pass over the reports at `paths`, which appends the
+    collectors and warnings to the spill files.
+
+    Return the tests (node ID -> (index of report, index of test in report,
+    outcome)), the collectors (node ID -> index in the spill file), the
+    failures by ID and the top-level keys of each report.
+    """
+    tests = {}
+    collectors = {}
+    failures = OrderedDict()
+    infos = []
+    for i, path in enumerate(paths):
+        info = {}
+        num_tests = 0
+        for type_, record in iter_records(path):
+            if type_ == 'test':
+                tests[record['nodeid']] = (i, num_tests, record['outcome'])
+                num_tests += 1
+            elif type_ == 'collector':
+                collectors[record['nodeid']] = collector_spill.append(record)
+            elif type_ == 'warning':
+                warning_spill.append(record)
+            elif type_ == 'failure':
+                failures[record.pop('id')] = record
+            elif type_ in ('header', 'summary'):
+                info.update(record)
+        infos.append(info)
+    return tests, collectors, failures, infos
+
+
+def _merge_infos(infos, outcomes):
+    """Return the top-level keys of the merged report."""
+    created = [info['created'] for info in infos if 'created' in info]
+    start = [info['created'] - info.get('duration', 0) for info in infos if
+             'created' in info]
+    exitcodes = [info['exitcode'] for info in infos if 'exitcode' in info]
+    summary_data = {}
+    for key in ('collected', 'deselected'):
+        counts = [info['summary'][key] for info in infos if
+                  key in info.get('summary', {})]
+        if counts:
+            summary_data[key] = sum(counts)
+    return serialize.make_report(
+        created=max(created) if created else None,
+        duration=max(created) - min(start) if created else None,
+        exitcode=_merge_exitcodes(exitcodes),
+        root=next((info['root'] for info in infos if 'root' in info), None),
+        environment=next((info['environment'] for info in infos if
+                          'environment' in info), {}),
+        summary=serialize.make_outcome_summary(outcomes, **summary_data),
+    )
+
+
+def _merge_exitcodes(exitcodes):
+    # Exit code 5 means that no tests were collected
+    relevant = [code for code in exitcodes if code != 5]
+    if relevant:
+        return max(relevant)
+    return 5 if exitcodes else None
+
+
+def _iter_merged_tests(paths, tests):
+    for i, path in enumerate(paths):
+        num_tests = 0
+        for type_, record in iter_records(path):
+            if type_ != 'test':
+                continue
+            if tests[record['nodeid']][:2] == (i, num_tests):
+                yield record
+            num_tests += 1
+
+
+class _Spill:
+    """Records kept in a temporary file."""
+
+    def __init__(self, encoder):
+        self._encoder = encoder
+        # pylint: disable=consider-using-with
+        self._file = tempfile.TemporaryFile()
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def append(self, record):
+        """Append `record` and return its index."""
+        self._file.write(self._encoder.dumps(record) + b'\n')
+        self._len += 1
+        return self._len - 1
+
+    def __iter__(self):
+        self._file.seek(0)
+        for line in self._file:
+            yield self._encoder.loads(line)
+
+    def close(self):
+        self._file.close()
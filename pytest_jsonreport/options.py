@@ -0,0 +1,155 @@
+"""Command line options of the plugin."""
+import argparse
+import logging
+import math
+
+from .encoders import ENCODERS
+from .serialize import LOG_FIELD_PRESETS
+from .store import STORES
+
+
+def add_options(parser):
+    """Add the command line options of the plugin to `parser`."""
+    group = parser.getgroup('jsonreport', 'reporting test results as JSON')
+    group.addoption(
+        '--json-report', default=False, action='store_true',
+        help='create JSON report')
+    group.addoption(
+        '--json-report-file', default='.report.json',
+        # The case-insensitive string "none" will make the value None
+        type=lambda x: None if x.lower() == 'none' else x,
+        help='target path to save JSON report (use "none" to not save the '
+        'report; add a .gz, .bz2 or .xz suffix to compress it)')
+    group.addoption(
+        '--json-report-omit', default=[], nargs='+', help='list of fields to '
+        'omit in the report (choose from: collectors, log, traceback, '
+        'streams, warnings, keywords)')
+    group.addoption(
+        '--json-report-details', default='all',
+        choices=['all', 'failed', 'none'], help='tests for which to include '
+        'captured output and logs (default: all)')
+    group.addoption(
+        '--json-report-summary', default=False,
+        action='store_true', help='only create a summary without per-test '
+        'details')
+    group.addoption(
+        '--json-report-stream', default=False, action='store_true',
+        help='write the report as newline-delimited JSON while tests are '
+        'running')
+    group.addoption(
+        '--json-report-store', default='memory', choices=sorted(STORES),
+        help='where to keep test details until the report is saved '
+        '(default: memory; "disk" keeps memory usage low for large test '
+        'suites)')
+    group.addoption(
+        '--json-report-sqlite', metavar='PATH',
+        help='also save the report to the SQLite database at PATH (sessions '
+        'are added to an existing database)')
+    group.addoption(
+        '--json-report-columnar', metavar='PATH',
+        help='also save the outcomes and stage durations of the tests as '
+        'columnar arrays to the NumPy .npz archive at PATH')
+    group.addoption(
+        '--json-report-index', default=False, action='store_true',
+        help='also save an index of the tests by node ID to the report path '
+        'plus ".idx" for fast lookups (not for compressed, compact or '
+        'streamed reports)')
+    group.addoption(
+        '--json-report-xdist-shards', default=False, action='store_true',
+        help='with pytest-xdist, let workers write test details to shard '
+        'files which are merged at the end of the session instead of sending '
+        'them to the controller (ignored with --json-report-stream)')
+    group.addoption(
+        '--json-report-checkpoint-interval', type=_interval,
+        metavar='SECONDS',
+        help='periodically save the report of the tests finished so far '
+        'while the session is running (ignored with --json-report-stream)')
+    group.addoption(
+        '--json-report-async', default=False, action='store_true',
+        help='encode and write test details on a background thread while '
+        'tests are running (with --json-report-stream, --json-report-store '
+        'disk, --json-report-sqlite and --json-report-xdist-shards)')
+    group.addoption(
+        '--json-report-fsync', default=False, action='store_true',
+        help='flush saved reports and their sidecar files to disk before '
+        'they replace the previous ones')
+    group.addoption(
+        '--json-report-encoder', default='stdlib',
+        choices=['auto'] + list(ENCODERS), help='JSON encoder to use '
+        '(default: stdlib; "auto" picks the fastest one installed)')
+    group.addoption(
+        '--json-report-aggregate-warnings', nargs='?', const=10, type=int,
+        metavar='MAX_NODEIDS', help='store identical warnings only once, '
+        'with the number of occurrences and up to MAX_NODEIDS (default: 10) '
+        'node IDs of the tests they occurred in')
+    group.addoption(
+        '--json-report-dedupe-failures', default=False, action='store_true',
+        help='store identical crash details, tracebacks and error '
+        'representations only once in a "failures" table')
+    group.addoption(
+        '--json-report-compact', default=False, action='store_true',
+        help='replace repeated strings with references into a string table')
+    group.addoption(
+        '--json-report-indent', type=int, help='pretty-print JSON with '
+        'specified indentation level')
+    group.addoption(
+        '--json-report-log-level', default=logging.NOTSET, type=_log_level,
+        help='minimum level of log records to include (default: all)')
+    group.addoption(
+        '--json-report-log-fields', default=['full'], nargs='+',
+        help='log record attributes to include (default: full; presets: '
+        '{})'.format(', '.join(
+            '{} = {}'.format(name, ' '.join(fields)) for name, fields in
+            sorted(LOG_FIELD_PRESETS.items()))))
+    group.addoption(
+        '--json-report-collapse-logs', choices=['consecutive', 'all'],
+        help='collapse consecutive (or all) log records of a test stage with '
+        'the same logger, level and message into one record with a repeat '
+        'count')
+    group.addoption(
+        '--json-report-max-stream-size', type=int, help='max number of bytes '
+        '(UTF-8) of stdout and stderr per test stage (keeps the start and '
+        'end)')
+    group.addoption(
+        '--json-report-max-longrepr-size', type=int, help='max number of '
+        'bytes (UTF-8) of the error representation per test stage (keeps the '
+        'start and end)')
+    group.addoption(
+        '--json-report-max-log-records', type=int, help='max number of log '
+        'records per test stage (keeps the first and last records)')
+    group.addoption(
+        '--json-report-max-capture-size', type=int, help='max total number '
+        'of bytes (UTF-8) of stdout, stderr and error representations per '
+        'session (per worker with xdist)')
+    group.addoption(
+        '--json-report-max-session-log-records', type=int, help='max total '
+        'number of log records per session (per worker with xdist)')
+    group.addoption(
+        '--json-report-profile', default=False, action='store_true',
+        help='measure the time spent in the plugin itself and add it to the '
+        'report (as "plugin_stats") and the terminal summary')
+    group._addoption(
+        '--json-report-verbosity', type=int, help='set verbosity (default is '
+        'value of --verbosity)')
+
+
+def _log_level(value):
+    """Return the numeric log level for the level name or number `value`."""
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    level = logging.getLevelName(value.upper())
+    if not isinstance(level, int):
+        raise ValueError('unknown log level: {}'.format(value))
+    return level
+
+
+def _interval(value):
+    """Return the number of seconds `value` as a float, which must be greater
+    than 0 (otherwise a thread waiting for it would never wait)."""
+    seconds = float(value)
+    if not 0 < seconds < math.inf:
+        raise argparse.ArgumentTypeError(
+            'must be a positive number of seconds: {}'.format(value))
+    return seconds
@@ -1,9 +1,12 @@
 from __future__ import print_function
-from collections import OrderedDict
-from contextlib import contextmanager
-import json
+from collections import Counter, OrderedDict
+from contextlib import contextmanager, nullcontext
+import functools
 import logging
 import os
+import shutil
+import sqlite3
+import tempfile
 import time
 import warnings
 
@@ -11,13 +14,45 @@ import pytest
 import _pytest.hookspec
 
 from . import serialize
+from .checkpoint import Checkpointer
+from .columnar import Columns
+from .compact import compact_report
+from .serialize import STAGES
+from .sqlite import SQLiteWriter
+from .stats import PluginStats, instrument_hooks
+from .encoders import StdlibEncoder, get_encoder
+from .index import IndexBuilder
+from .logs import LoggingHandler, log_fields
+from .options import add_options
+from .store import STORES, MemoryTestStore, StoredTests
+from .writer import (COMPRESSION_MODULES, BackgroundWriter, StreamWriter,
+                     atomic_report_file, dump_report, make_dirs)
+
+# Used instead of measuring operations if profiling is disabled
+_NO_MEASURE = nullcontext()
 
 
 class JSONReportBase:
 
+    # Helper methods which are measured when profiling (in addition to hooks)
+    _profiled_methods = ('_validate_metadata', '_keep_details', '_truncate',
+                         '_report_extra')
+
     def __init__(self, config=None):
         self._config = config
         self._logger = logging.getLogger()
+        self._log_handler = None
+        self._log_fields = None
+        # Remaining number of bytes of captured text for the session
+        self._capture_budget = None
+        # Remaining number of log records for the session
+        self._log_budget = None
+        self._encoder = StdlibEncoder()
+        self._stats = None
+        # Thread for encoding and writing (see `--json-report-async`)
+        self._writer = None
+        # Whether only outcomes are needed (see `--json-report-summary`)
+        self._summary_only = False
 
     def pytest_configure(self, config):
         # When the plugin is used directly from code, it may have been
@@ -26,6 +61,22 @@ class JSONReportBase:
             self._config = config
         if not hasattr(config, '_json_report'):
             self._config._json_report = self
+        self._encoder = get_encoder(self._config.option.json_report_encoder)
+        self._log_fields = log_fields(
+            self._config.option.json_report_log_fields)
+        self._capture_budget = self._config.option.json_report_max_capture_size
+        self._log_budget = \
+            self._config.option.json_report_max_session_log_records
+        # The SQLite database and columnar export need the test details even
+        # if the report is just a summary
+        self._summary_only = self._config.option.json_report_summary and \
+            not self._config.option.json_report_sqlite and \
+            not self._config.option.json_report_columnar
+        if self._config.option.json_report_profile:
+            self._stats = PluginStats()
+            for name in self._profiled_methods:
+                setattr(self, name, self._stats.wrap(
+                    name.lstrip('_'), getattr(self, name)))
         # If the user sets --tb=no, always omit the traceback from the report
         if self._config.option.tbstyle == 'no' and \
            not self._must_omit('traceback'):
@@ -34,26 +85,86 @@ class JSONReportBase:
     def pytest_addhooks(self, pluginmanager):
         pluginmanager.add_hookspecs(Hooks)
 
+    def pytest_sessionstart(self, session):
+        if self._stats is not None:
+            # The plugin isn't fully registered yet in `pytest_configure`
+            instrument_hooks(self._stats, self._config.pluginmanager, self)
+        if self._config.option.json_report_async:
+            self._writer = BackgroundWriter()
+        if self._must_omit('log'):
+            return
+        # A single handler is used for the whole session. It only collects
+        # records while a test stage is running (see `_capture_log`).
+        self._log_handler = LoggingHandler(
+            self._config.option.json_report_log_level, self._log_fields,
+            self._config.option.json_report_max_log_records,
+            self._config.option.json_report_collapse_logs)
+        if self._stats is not None:
+            for name in ('start', 'stop', 'emit'):
+                setattr(self._log_handler, name, self._stats.wrap(
+                    'log_' + name, getattr(self._log_handler, name)))
+        self._logger.addHandler(self._log_handler)
+
+    def pytest_sessionfinish(self, session):
+        if self._log_handler is not None:
+            self._logger.removeHandler(self._log_handler)
+            self._log_handler = None
+
     @pytest.hookimpl(hookwrapper=True)
     def pytest_runtest_protocol(self, item, nextitem):
         item._json_report_extra = {}
+        item._json_report_failed = False
         yield
+        self._finish_item(item)
         del item._json_report_extra
+        del item._json_report_failed
+
+    def _finish_item(self, item):
+        """Called after all stages of `item` have run."""
+
+    def _write(self, func, *args):
+        """Call the write operation `func(*args)`, on the thread of the
+        background writer if there is one."""
+        if self._writer is None:
+            func(*args)
+        else:
+            self._writer.submit(func, *args)
+
+    def _close_writer(self):
+        """Wait for pending write operations and stop the background
+        writer."""
+        if self._writer is not None:
+            writer, self._writer = self._writer, None
+            writer.close()
+
+    def _measure(self, name):
+        """Return a context manager which measures the operation `name` if
+        profiling is enabled (see `stats.PluginStats`)."""
+        if self._stats is None:
+            return _NO_MEASURE
+        return self._stats.measure(name)
 
     @contextmanager
     def _capture_log(self, item, when):
-        handler = LoggingHandler()
-        self._logger.addHandler(handler)
+        # The handler is gone if a test reconfigured logging, e.g. with
+        # `logging.config.dictConfig()`
+        if self._log_handler not in self._logger.handlers:
+            self._logger.addHandler(self._log_handler)
+        self._log_handler.start(
+            None if self._log_budget is None else max(self._log_budget, 0))
         try:
             yield
         finally:
-            self._logger.removeHandler(handler)
-        item._json_report_extra[when]['log'] = handler.records
+            records, num_dropped = self._log_handler.stop()
+        item._json_report_extra[when]['log'] = records
+        if num_dropped:
+            item._json_report_extra[when].setdefault(
+                'truncated', {})['log'] = num_dropped
 
     @pytest.hookimpl(hookwrapper=True)
     def pytest_runtest_setup(self, item):
         item._json_report_extra['setup'] = {}
-        if self._must_omit('log'):
+        if self._log_handler is None:
             yield
         else:
             with self._capture_log(item, 'setup'):
@@ -62,7 +173,7 @@ class JSONReportBase:
     @pytest.hookimpl(hookwrapper=True)
     def pytest_runtest_call(self, item):
         item._json_report_extra['call'] = {}
-        if self._must_omit('log'):
+        if self._log_handler is None:
             yield
         else:
             with self._capture_log(item, 'call'):
@@ -71,7 +182,7 @@ class JSONReportBase:
     @pytest.hookimpl(hookwrapper=True)
     def pytest_runtest_teardown(self, item):
         item._json_report_extra['teardown'] = {}
-        if self._must_omit('log'):
+        if self._log_handler is None:
             yield
         else:
             with self._capture_log(item, 'teardown'):
@@ -81,12 +192,18 @@ class JSONReportBase:
     def pytest_runtest_makereport(self, item, call):
         # Hook runtest_makereport to access the item *and* the report
         report = (yield).get_result()
+        if self._summary_only:
+            report._json_report_extra = {}
+            return
         if not self._must_omit('streams'):
-            streams = {key: val for when_, key, val in item._report_sections if
-                       when_ == report.when and key in ['stdout', 'stderr']}
-            item._json_report_extra[call.when].update(streams)
-        for dict_ in self._config.hook.pytest_json_runtest_metadata(item=item,
-                                                                    call=call):
+            item._json_report_extra[call.when].update(
+                (key, val) for when_, key, val in item._report_sections if
+                when_ == report.when and key in ['stdout', 'stderr'])
+        self._keep_details(item, report)
+        with self._measure('dispatch_runtest_metadata'):
+            dicts = self._config.hook.pytest_json_runtest_metadata(item=item,
+                                                                   call=call)
+        for dict_ in dicts:
             if not dict_:
                 continue
             item._json_report_extra.setdefault('metadata', {}).update(dict_)
@@ -94,32 +211,114 @@ class JSONReportBase:
         # Attach the JSON details to the report. If this is an xdist worker,
         # the details will be serialized and relayed with the other attributes
         # of the report.
-        report._json_report_extra = item._json_report_extra
+        report._json_report_extra = self._report_extra(item, report)
+
+    def _keep_details(self, item, report):
+        """Truncate the captured output of the stages of `item` which is kept
+        in the report, and count it and the log records against the limits of
+        the session.
 
-    @staticmethod
-    def _validate_metadata(item):
+        Details which may still be dropped (see `_report_extra`) are only
+        counted once they're kept, so they don't use up the limits.
+        """
+        if self._config.option.json_report_details != 'failed' or \
+           item._json_report_failed:
+            whens = [report.when]
+        elif report.failed:
+            # The output held back so far is kept as well
+            whens = STAGES
+        else:
+            return
+        for when in whens:
+            details = item._json_report_extra.get(when, {})
+            if self._log_budget is not None:
+                self._log_budget -= len(details.get('log', ()))
+            for key in ('stdout', 'stderr'):
+                if key not in details:
+                    continue
+                details[key], num_removed = self._truncate(
+                    details[key],
+                    self._config.option.json_report_max_stream_size)
+                if num_removed:
+                    details.setdefault('truncated', {})[key] = num_removed
+
+    def _report_extra(self, item, report):
+        """Return the JSON details of `item` to attach to `report`."""
+        if self._config.option.json_report_details != 'failed':
+            return item._json_report_extra
+        if report.failed:
+            item._json_report_failed = True
+        if item._json_report_failed:
+            # Includes the stage details held back so far
+            return item._json_report_extra
+        # Hold back the stage details until we know whether the test fails
+        return {key: val for key, val in item._json_report_extra.items() if
+                key not in STAGES}
+
+    def _truncate(self, text, limit):
+        """Truncate captured `text` to `limit` bytes and to the remaining
+        capture budget of the session.
+
+        Return the text and the number of bytes removed.
+        """
+        budget = self._capture_budget
+        if budget is None:
+            return serialize.truncate(text, limit)
+        limit = budget if limit is None else min(limit, budget)
+        size = serialize.text_size(text)
+        text, num_removed = serialize.truncate(text, limit)
+        self._capture_budget -= size - num_removed
+        return text, num_removed
+
+    def _validate_metadata(self, item):
         """Ensure that `item` has JSON-serializable metadata, otherwise delete
         it."""
         if 'metadata' not in item._json_report_extra:
             return
-        if not serialize.serializable(item._json_report_extra['metadata']):
+        if not serialize.serializable(item._json_report_extra['metadata'],
+                                      self._encoder):
             warnings.warn(
                 'Metadata of {} is not JSON-serializable.'.format(item.nodeid))
             del item._json_report_extra['metadata']
 
     def _must_omit(self, key):
+        # A summary has no details at all, so nothing needs to be captured
+        if self._summary_only:
+            return True
+        if key in ('log', 'streams') and \
+           self._config.option.json_report_details == 'none':
+            return True
         return key in self._config.option.json_report_omit
 
 
 class JSONReport(JSONReportBase):
     """The JSON report pytest plugin."""
 
+    _profiled_methods = JSONReportBase._profiled_methods + (
+        '_dedupe_failure', '_stream_test', '_flush_stream', '_merge_shards',
+        'save_report')
+
     def __init__(self, *args, **kwargs):
         JSONReportBase.__init__(self, *args, **kwargs)
         self._start_time = None
-        self._json_tests = OrderedDict()
+        self._json_tests = MemoryTestStore()
         self._json_collectors = []
         self._json_warnings = []
+        # Aggregated warnings by key (see `--json-report-aggregate-warnings`)
+        self._aggregated_warnings = {}
+        # Unique failures by ID (see `--json-report-dedupe-failures`)
+        self._json_failures = OrderedDict()
+        # Node ID -> outcome of tests that have already been streamed (or of
+        # all tests if only a summary is needed)
+        self._json_outcomes = {}
+        self._stream = None
+        self._sqlite = None
+        self._sqlite_error = None
+        self._columns = None
+        self._checkpoint = None
+        # Directory of the xdist worker shards (see
+        # `--json-report-xdist-shards`)
+        self._shard_dir = None
         self._num_deselected = 0
         self._terminal_summary = ''
         # Min verbosity required to print to terminal
@@ -127,7 +326,69 @@ class JSONReport(JSONReportBase):
         self.report = None
 
     def pytest_sessionstart(self, session):
+        JSONReportBase.pytest_sessionstart(self, session)
         self._start_time = time.time()
+        self._json_tests = STORES[self._config.option.json_report_store](
+            self._encoder, self._writer,
+            self._config.option.json_report_indent)
+        path = self._config.option.json_report_file
+        if self._config.option.json_report_stream and path:
+            self._open_stream(path, session)
+        if self._config.option.json_report_sqlite:
+            self._open_sqlite(self._config.option.json_report_sqlite)
+        if self._config.option.json_report_columnar:
+            self._columns = Columns()
+            self._columns.add_run(self._start_time)
+        # Streamed reports are always complete up to the last finished test
+        if self._config.option.json_report_checkpoint_interval and path and \
+           self._stream is None:
+            self._checkpoint = Checkpointer(
+                self._config,
+                functools.partial(self._make_checkpoint, session),
+                self._encoder)
+            self._checkpoint.start()
+
+    def _open_sqlite(self, path):
+        try:
+            self._sqlite = SQLiteWriter(path, self._start_time)
+        # The session goes on without the database, and the error is
+        # reported in the terminal summary
+        except (OSError, sqlite3.Error) as e:
+            self._sqlite_error = 'could not open SQLite database: {}'.format(
+                e)
+
+    def _write_sqlite(self, name, *args):
+        """Call the method `name` of the SQLite writer with `args` (see
+        `_write`)."""
+        self._write(self._call_sqlite, self._sqlite, name, args)
+
+    def _call_sqlite(self, sqlite, name, args):
+        # The database is dropped after the first error, e.g. if other
+        # sessions held its lock for longer than `sqlite.LOCK_TIMEOUT`
+        if self._sqlite_error is not None:
+            return
+        try:
+            getattr(sqlite, name)(*args)
+        except sqlite3.Error as e:
+            self._sqlite_error = \
+                'could not write to SQLite database: {}'.format(e)
+            self._sqlite = None
+            sqlite.abort()
+
+    def _open_stream(self, path, session):
+        try:
+            self._stream = StreamWriter(
+                path, self._encoder, self._config.option.json_report_compact)
+        # Fall back to saving the report at the end of the session, which
+        # will then report the error
+        except OSError:
+            return
+        self._write(self._stream.write, 'header', {
+            'start': self._start_time,
+            'root': str(session.fspath),
+            'environment': getattr(self._config, '_metadata', {}),
+        })
+        self._flush_stream()
 
     def pytest_collectreport(self, report):
         if self._must_omit('collectors'):
@@ -162,17 +423,21 @@ class JSONReport(JSONReportBase):
                 del item._json_collectitem
             except AttributeError:
                 pass
+        # Collectors are final once deselection is done
+        self._flush_stream()
 
     def pytest_runtest_logreport(self, report):
         # The `_json_report_extra` attr may have been lost, e.g. when the
         # original report object got replaced due to a crashed xdist worker (#75)
         if not hasattr(report, '_json_report_extra'):
             report._json_report_extra = {}
+        if self._summary_only:
+            self._count_outcome(report)
+            return
 
         nodeid = report.nodeid
-        try:
-            json_testitem = self._json_tests[nodeid]
-        except KeyError:
+        json_testitem = self._json_tests.get(nodeid)
+        if json_testitem is None:
             json_testitem = serialize.make_testitem(
                 nodeid,
                 # report.keywords is a dict (for legacy reasons), but we just
@@ -180,41 +445,211 @@ class JSONReport(JSONReportBase):
                 None if self._must_omit('keywords') else list(report.keywords),
                 report.location,
             )
-            self._json_tests[nodeid] = json_testitem
+            self._json_tests.add(nodeid, json_testitem)
         metadata = report._json_report_extra.get('metadata')
         if metadata:
             json_testitem['metadata'] = metadata
         # Add user properties in teardown stage if attribute exists and is non-empty
         if report.when == 'teardown' and getattr(report, 'user_properties', None):
             user_properties = [{str(key): val} for key, val in report.user_properties]
-            if serialize.serializable(user_properties):
+            if serialize.serializable(user_properties, self._encoder):
                 json_testitem['user_properties'] = user_properties
             else:
                 warnings.warn('User properties of {} are not JSON-serializable.'.format(nodeid))
 
         # Update total test outcome, if necessary. The total outcome can be
         # different from the outcome of the setup/call/teardown stage.
-        outcome = self._config.hook.pytest_report_teststatus(
-            report=report, config=self._config)[0]
+        with self._measure('dispatch_report_teststatus'):
+            outcome = self._config.hook.pytest_report_teststatus(
+                report=report, config=self._config)[0]
         if outcome not in ['passed', '']:
             json_testitem['outcome'] = outcome
-        json_testitem[report.when] = \
-            self._config.hook.pytest_json_runtest_stage(report=report)
+        with self._measure('dispatch_runtest_stage'):
+            json_testitem[report.when] = \
+                self._config.hook.pytest_json_runtest_stage(report=report)
+        # Skipped stages have a crash if they're expected failures, otherwise
+        # their longrepr is just the skip reason
+        if self._config.option.json_report_dedupe_failures and \
+           (report.failed or 'crash' in json_testitem[report.when]):
+            self._dedupe_failure(json_testitem[report.when])
+        if self._config.option.json_report_details == 'failed':
+            self._add_held_back_details(json_testitem, report)
+        if self._columns is not None and report.when == 'setup':
+            # Only available from pytest 7.1
+            self._columns.set_start(nodeid, getattr(report, 'start', None))
+        # The teardown stage always comes last, unless the report is a
+        # placeholder for a crashed xdist worker (`when` is "???")
+        if report.when not in ('setup', 'call'):
+            self._finish_test(nodeid, json_testitem)
+
+    def _finish_test(self, nodeid, json_testitem):
+        """Pass on the finished `json_testitem` to the outputs."""
+        if self._columns is not None:
+            self._columns.add_test(json_testitem)
+        # With xdist shards, the details of the test are only available at
+        # the end of the session
+        if self._sqlite is not None and self._shard_dir is None:
+            # A copy, since the item may change if the test is rerun before
+            # it's written
+            self._write_sqlite('add_test', dict(json_testitem))
+        if self._checkpoint is not None:
+            self._checkpoint.add_test(json_testitem)
+        if self._stream is not None:
+            self._stream_test(nodeid)
+        else:
+            self._json_tests.finish(nodeid)
+
+    def _count_outcome(self, report):
+        """Update the outcome of a test without building its test item."""
+        nodeid = report.nodeid
+        with self._measure('dispatch_report_teststatus'):
+            outcome = self._config.hook.pytest_report_teststatus(
+                report=report, config=self._config)[0]
+        outcome = self._update_outcome(nodeid, outcome)
+        if report.when not in ('setup', 'call') and \
+           self._checkpoint is not None:
+            self._checkpoint.add_test({'nodeid': nodeid, 'outcome': outcome})
+
+    def _update_outcome(self, nodeid, outcome):
+        """Update the outcome of a test which has no test item (anymore) and
+        return it.
+
+        The outcome is updated like the outcome of a test item, which is kept
+        if the test is rerun, so each test is only counted once.
+        """
+        if outcome not in ['passed', '']:
+            self._json_outcomes[nodeid] = outcome
+            return outcome
+        return self._json_outcomes.setdefault(nodeid, 'passed')
+
+    def _dedupe_failure(self, stage):
+        """Move the failure details of `stage` to the failures table and
+        replace them with a reference."""
+        failure = serialize.make_failure(stage)
+        if not failure:
+            return
+        failure_id = serialize.make_failure_id(failure, self._encoder)
+        if failure_id not in self._json_failures:
+            self._json_failures[failure_id] = failure
+            if self._sqlite is not None:
+                self._write_sqlite('add_failure', failure_id, failure)
+            if self._stream is not None and \
+               not self._config.option.json_report_summary:
+                self._write(self._stream.write, 'failure',
+                            {'id': failure_id, **failure})
+        stage['failure'] = failure_id
+
+    def _add_held_back_details(self, json_testitem, report):
+        """Add details of earlier stages of a test which were held back
+        until the test failed (see `_report_extra`)."""
+        self._add_stage_details(json_testitem, report._json_report_extra,
+                                exclude=report.when)
+
+    def _add_stage_details(self, json_testitem, extra, exclude=None):
+        """Add the captured output and logs of `extra` to the stages of a
+        test item."""
+        for when in STAGES:
+            details = extra.get(when)
+            if when == exclude or not details or when not in json_testitem:
+                continue
+            stage = json_testitem[when]
+            log = details.get('log')
+            if log and self._log_fields is not None:
+                log = serialize.make_log(log, self._log_fields)
+            for key, val in [('stdout', details.get('stdout')),
+                             ('stderr', details.get('stderr')), ('log', log)]:
+                if val:
+                    stage[key] = val
+            if details.get('truncated'):
+                stage.setdefault('truncated', {}).update(details['truncated'])
+
+    @pytest.hookimpl(optionalhook=True)
+    def pytest_configure_node(self, node):
+        """Tell an xdist worker where to write its shard of test details."""
+        # Streamed tests need their details as soon as they're finished
+        if not self._config.option.json_report_xdist_shards or \
+           self._config.option.json_report_stream or self._summary_only:
+            return
+        if self._shard_dir is None:
+            self._shard_dir = tempfile.mkdtemp(prefix='pytest-json-report-')
+        node.workerinput['json_report_shard_dir'] = self._shard_dir
+
+    def _merge_shards(self):
+        """Add the test details from the shards of the xdist workers to the
+        test items."""
+        for name in sorted(os.listdir(self._shard_dir)):
+            with open(os.path.join(self._shard_dir, name), 'rb') as f:
+                for line in f:
+                    try:
+                        record = self._encoder.loads(line)
+                    # The last line is incomplete if the worker crashed
+                    except ValueError:
+                        continue
+                    nodeid = record['nodeid']
+                    json_testitem = self._json_tests.get(nodeid)
+                    if json_testitem is None:
+                        continue
+                    if record['extra'].get('metadata'):
+                        json_testitem['metadata'] = record['extra']['metadata']
+                    self._add_stage_details(json_testitem, record['extra'])
+                    self._json_tests.finish(nodeid)
+        shutil.rmtree(self._shard_dir, ignore_errors=True)
+        self._shard_dir = None
+
+    def _stream_test(self, nodeid):
+        json_testitem = self._json_tests.pop(nodeid)
+        self._update_outcome(nodeid, json_testitem['outcome'])
+        if not self._config.option.json_report_summary:
+            self._write(self._stream.write, 'test', json_testitem)
+
+    def _flush_stream(self, final=False):
+        """Write pending collectors and warnings to the report stream.
+
+        Aggregated warnings are only written if `final` is true, since their
+        counts may still change until then.
+        """
+        if self._stream is None:
+            return
+        flush_warnings = \
+            final or not self._config.option.json_report_aggregate_warnings
+        if not self._config.option.json_report_summary:
+            for collector in self._json_collectors:
+                self._write(self._stream.write, 'collector', collector)
+            if flush_warnings:
+                for warning in self._json_warnings:
+                    self._write(self._stream.write, 'warning', warning)
+        del self._json_collectors[:]
+        if flush_warnings:
+            del self._json_warnings[:]
 
     @pytest.hookimpl(trylast=True)
     def pytest_json_runtest_stage(self, report):
         stage_details = report._json_report_extra.get(report.when, {})
-        return serialize.make_teststage(
+        log = stage_details.get('log')
+        if log and self._log_fields is not None:
+            log = serialize.make_log(log, self._log_fields)
+        stage = serialize.make_teststage(
             report,
             # TODO Can we use pytest's BaseReport.capstdout/err/log here?
             stage_details.get('stdout'),
             stage_details.get('stderr'),
-            stage_details.get('log'),
+            log,
             self._must_omit('traceback'),
         )
-
-    @pytest.hookimpl(tryfirst=True)
-    def pytest_sessionfinish(self, session):
+        truncated = dict(stage_details.get('truncated', {}))
+        if 'longrepr' in stage:
+            stage['longrepr'], num_removed = self._truncate(
+                stage['longrepr'],
+                self._config.option.json_report_max_longrepr_size)
+            if num_removed:
+                truncated['longrepr'] = num_removed
+        if truncated:
+            stage['truncated'] = truncated
+        return stage
+
+    def _make_report(self, session, outcomes, exitcode):
+        """Return the report of the session without the collectors, tests,
+        failures and warnings."""
         summary_data = {
             # Need to add deselected count to get correct number of collected
             # tests (see pytest-dev/pytest#9614)
@@ -222,28 +657,47 @@ class JSONReport(JSONReportBase):
         }
         if self._num_deselected:
             summary_data['deselected'] = self._num_deselected
-
-        json_report = serialize.make_report(
+        return serialize.make_report(
             created=time.time(),
             duration=time.time() - self._start_time,
-            exitcode=session.exitstatus,
+            exitcode=exitcode,
             root=str(session.fspath),
             environment=getattr(self._config, '_metadata', {}),
-            summary=serialize.make_summary(self._json_tests, **summary_data),
+            summary=serialize.make_outcome_summary(outcomes, **summary_data),
         )
-        if not self._config.option.json_report_summary:
-            if self._json_collectors:
-                json_report['collectors'] = self._json_collectors
-            json_report['tests'] = list(self._json_tests.values())
-            if self._json_warnings:
-                json_report['warnings'] = self._json_warnings
 
-        self._config.hook.pytest_json_modifyreport(json_report=json_report)
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_sessionfinish(self, session):
+        JSONReportBase.pytest_sessionfinish(self, session)
+        # The last checkpoint must not replace the report
+        if self._checkpoint is not None:
+            self._checkpoint.stop()
+            self._checkpoint = None
+        sharded = self._shard_dir is not None
+        if sharded:
+            self._merge_shards()
+        # The stores and writers need to be up to date from here on
+        if self._writer is not None:
+            self._writer.flush()
+        if self._sqlite is not None:
+            self._finish_sqlite(sharded)
+        if self._columns is not None:
+            self._finish_columns()
+        streamed = self._stream is not None
+        if streamed:
+            self._finish_stream()
+
+        json_report = self._build_report(session)
+        with self._measure('dispatch_modifyreport'):
+            self._config.hook.pytest_json_modifyreport(json_report=json_report)
         # After the session has finished, other scripts may want to use report
         # object directly
         self.report = json_report
+        self._close_outputs(json_report)
         path = self._config.option.json_report_file
-        if path:
+        if streamed:
+            self._terminal_summary = 'report streamed to: {}'.format(path)
+        elif path:
             try:
                 self.save_report(path)
             except OSError as e:
@@ -253,6 +707,88 @@ class JSONReport(JSONReportBase):
         else:
             self._terminal_summary = 'report auto-save skipped'
             self._terminal_min_verbosity = 1
+        if self._sqlite_error is not None:
+            self._terminal_summary += '\n' + self._sqlite_error
+            self._terminal_min_verbosity = 0
+
+    def _finish_sqlite(self, sharded):
+        """Add the tests which haven't been written to the SQLite database."""
+        if sharded:
+            json_testitems = self._json_tests.values()
+        else:
+            # Tests may be left unfinished, e.g. if the session was aborted
+            json_testitems = [
+                self._json_tests.get(nodeid) for nodeid in self._json_tests
+                if not self._sqlite.has_test(nodeid)]
+        for json_testitem in json_testitems:
+            self._write_sqlite('add_test', json_testitem)
+
+    def _finish_columns(self):
+        """Add the tests which haven't been added to the columnar export."""
+        for nodeid in self._json_tests:
+            if not self._columns.has_test(nodeid):
+                self._columns.add_test(self._json_tests.get(nodeid))
+
+    def _finish_stream(self):
+        """Write the remaining tests, collectors and warnings to the report
+        stream."""
+        # Tests may be left unfinished, e.g. if the session was aborted
+        for nodeid in list(self._json_tests):
+            self._stream_test(nodeid)
+        self._flush_stream(final=True)
+
+    def _build_report(self, session):
+        """Return the final report of the session."""
+        outcomes = Counter(self._json_outcomes.values())
+        outcomes.update(self._json_tests.outcomes())
+        json_report = self._make_report(session, outcomes,
+                                        session.exitstatus)
+        # Streamed reports already contain all details
+        if self._stream is None:
+            self._add_details(json_report, self._json_tests.tests())
+        if self._stats is not None:
+            json_report['plugin_stats'] = self._stats.to_dict()
+        return json_report
+
+    def _make_checkpoint(self, session, outcomes, tests):
+        """Return the report of a checkpoint with the outcomes and items of
+        the tests finished so far (see `checkpoint.Checkpointer`)."""
+        json_report = self._make_report(session, outcomes, exitcode=None)
+        self._add_details(json_report, tests)
+        return json_report
+
+    def _add_details(self, json_report, tests):
+        """Add the collectors, `tests`, failures and warnings to
+        `json_report` unless only a summary is needed."""
+        if self._config.option.json_report_summary:
+            return
+        # Copies, since checkpoints are made while the tests keep adding to
+        # these (copying is atomic)
+        if self._json_collectors:
+            json_report['collectors'] = list(self._json_collectors)
+        json_report['tests'] = tests
+        if self._json_failures:
+            json_report['failures'] = OrderedDict(
+                list(self._json_failures.items()))
+        if self._json_warnings:
+            json_report['warnings'] = list(self._json_warnings)
+
+    def _close_outputs(self, json_report):
+        """Finish the SQLite database, report stream and columnar export with
+        the final `json_report`."""
+        if self._sqlite is not None:
+            self._write_sqlite('close', json_report)
+            self._sqlite = None
+        if self._stream is not None:
+            self._write(self._stream.write, 'summary', json_report)
+            self._write(self._stream.close)
+            self._stream = None
+        self._close_writer()
+        if self._columns is not None:
+            make_dirs(self._config.option.json_report_columnar)
+            self._columns.save(self._config.option.json_report_columnar,
+                               self._config.option.json_report_fsync)
+            self._columns = None
 
     def save_report(self, path):
         """Save the JSON report to `path`.
@@ -262,65 +798,140 @@ class JSONReport(JSONReportBase):
         if self.report is None:
             raise Exception('could not save report: no report available')
         # Create path if it doesn't exist
-        dirname = os.path.dirname(path)
-        if dirname:
-            try:
-                os.makedirs(dirname)
-            # Mimick FileExistsError for py2.7 compatibility
-            except OSError as e:
-                import errno  # pylint: disable=import-outside-toplevel
-                if e.errno != errno.EEXIST:
-                    raise
-        with open(path, 'w', encoding='utf-8') as f:
-            json.dump(
-                self.report,
-                f,
-                default=str,
-                indent=self._config.option.json_report_indent,
-            )
+        make_dirs(path)
+        report = self.report
+        indent = self._config.option.json_report_indent
+        if self._config.option.json_report_compact:
+            report = compact_report(report)
+        elif isinstance(report.get('tests'), StoredTests):
+            report = dict(report, tests=report['tests'].encoded(
+                self._encoder, indent))
+        index = None
+        # Offsets into compressed or compact reports aren't useful for lookups
+        if self._config.option.json_report_index and \
+           not self._config.option.json_report_compact and \
+           os.path.splitext(path)[1].lower() not in COMPRESSION_MODULES:
+            index = IndexBuilder()
+        fsync = self._config.option.json_report_fsync
+        with atomic_report_file(path, fsync) as f:
+            dump_report(report, f, indent=indent, encoder=self._encoder,
+                        on_item=index)
+        if index is not None:
+            index.save(path, fsync)
+
+    def pytest_warning_recorded(self, warning_message, when, nodeid):
+        self._record_warning(warning_message, when, nodeid)
+
+    # Warning hook fallback (warning_recorded is available from pytest>=6)
+    if not hasattr(_pytest.hookspec, 'pytest_warning_recorded'):
+        def pytest_warning_captured(self, warning_message, when, item):
+            self._record_warning(warning_message, when,
+                                 item.nodeid if item is not None else '')
+        del pytest_warning_recorded
 
-    def pytest_warning_recorded(self, warning_message, when):
+    def _record_warning(self, warning_message, when, nodeid):
         if self._config is None:
             # If pytest is invoked directly from code, it may try to capture
             # warnings before the config is set.
             return
-        if not self._must_omit('warnings'):
-            self._json_warnings.append(
-                serialize.make_warning(warning_message, when))
-
-    # Warning hook fallback (warning_recorded is available from pytest>=6)
-    if not hasattr(_pytest.hookspec, 'pytest_warning_recorded'):
-        pytest_warning_captured = pytest_warning_recorded
-        del pytest_warning_recorded
+        if self._must_omit('warnings'):
+            return
+        warning = serialize.make_warning(warning_message, when)
+        if self._sqlite is not None:
+            self._write_sqlite('add_warning', warning)
+        max_nodeids = self._config.option.json_report_aggregate_warnings
+        if max_nodeids is None:
+            self._json_warnings.append(warning)
+            self._flush_stream()
+            return
+        key = serialize.warning_key(warning)
+        aggregated = self._aggregated_warnings.get(key)
+        if aggregated is None:
+            # All keys are added up front, since a checkpoint may be encoding
+            # the warning while it changes
+            aggregated = self._aggregated_warnings[key] = dict(
+                warning, count=0, nodeids=[])
+            self._json_warnings.append(aggregated)
+        aggregated['count'] += 1
+        if nodeid and len(aggregated['nodeids']) < max_nodeids and \
+           nodeid not in aggregated['nodeids']:
+            aggregated['nodeids'].append(nodeid)
+
+    @pytest.hookimpl(optionalhook=True)
+    def pytest_testnodedown(self, node, error):
+        stats = getattr(node, 'workeroutput', {}).get('json_report_stats')
+        if stats and self._stats is not None:
+            self._stats.update(stats)
 
     def pytest_terminal_summary(self, terminalreporter):
-        if self._terminal_min_verbosity > (
-                self._config.option.json_report_verbosity if
-                self._config.option.json_report_verbosity is not None else
-                terminalreporter.verbosity):
+        show_summary = self._terminal_min_verbosity <= (
+            self._config.option.json_report_verbosity if
+            self._config.option.json_report_verbosity is not None else
+            terminalreporter.verbosity)
+        if not show_summary and self._stats is None:
             return
         terminalreporter.write_sep('-', 'JSON report')
-        terminalreporter.write_line(self._terminal_summary)
+        if show_summary:
+            terminalreporter.write_line(self._terminal_summary)
+        if self._stats is not None:
+            num_tests = self.report['summary']['total'] if self.report else 0
+            for line in self._stats.summary_lines(num_tests):
+                terminalreporter.write_line(line)
 
 
 class JSONReportWorker(JSONReportBase):
 
-    pass
-
+    def __init__(self, *args, **kwargs):
+        JSONReportBase.__init__(self, *args, **kwargs)
+        # Shard file for test details (see `--json-report-xdist-shards`)
+        self._shard = None
 
-class LoggingHandler(logging.Handler):
+    def pytest_sessionstart(self, session):
+        JSONReportBase.pytest_sessionstart(self, session)
+        shard_dir = self._config.workerinput.get('json_report_shard_dir')
+        if shard_dir:
+            path = os.path.join(
+                shard_dir, self._config.workerinput['workerid'] + '.jsonl')
+            # Append, in case a restarted worker gets the same ID
+            # pylint: disable=consider-using-with
+            self._shard = open(path, 'ab')
 
-    def __init__(self):
-        super().__init__()
-        self.records = []
+    def pytest_sessionfinish(self, session):
+        JSONReportBase.pytest_sessionfinish(self, session)
+        self._close_writer()
+        if self._shard is not None:
+            self._shard.close()
+            self._shard = None
+        # Sent to the controller (see `JSONReport.pytest_testnodedown`), which
+        # can't receive an OrderedDict
+        if self._stats is not None:
+            self._config.workeroutput['json_report_stats'] = dict(
+                self._stats.to_dict())
+
+    def _report_extra(self, item, report):
+        if self._shard is None:
+            return JSONReportBase._report_extra(self, item, report)
+        if report.failed:
+            item._json_report_failed = True
+        # The details are written to the shard once the test has finished,
+        # so only the report itself is sent to the controller
+        return {}
+
+    def _finish_item(self, item):
+        if self._shard is None:
+            return
+        extra = {key: val for key, val in item._json_report_extra.items() if
+                 val}
+        if self._config.option.json_report_details == 'failed' and \
+           not item._json_report_failed:
+            extra = {key: val for key, val in extra.items() if
+                     key not in STAGES}
+        if extra:
+            self._write(self._write_shard,
+                        {'nodeid': item.nodeid, 'extra': extra})
 
-    def emit(self, record):
-        d = dict(record.__dict__)
-        d['msg'] = record.getMessage()
-        d['args'] = None
-        d['exc_info'] = None
-        d.pop('message', None)
-        self.records.append(d)
+    def _write_shard(self, record):
+        self._shard.write(self._encoder.dumps(record) + b'\n')
 
 
 class Hooks:
@@ -364,30 +975,7 @@ def json_metadata(request):
 
 
 def pytest_addoption(parser):
-    group = parser.getgroup('jsonreport', 'reporting test results as JSON')
-    group.addoption(
-        '--json-report', default=False, action='store_true',
-        help='create JSON report')
-    group.addoption(
-        '--json-report-file', default='.report.json',
-        # The case-insensitive string "none" will make the value None
-        type=lambda x: None if x.lower() == 'none' else x,
-        help='target path to save JSON report (use "none" to not save the '
-        'report)')
-    group.addoption(
-        '--json-report-omit', default=[], nargs='+', help='list of fields to '
-        'omit in the report (choose from: collectors, log, traceback, '
-        'streams, warnings, keywords)')
-    group.addoption(
-        '--json-report-summary', default=False,
-        action='store_true', help='only create a summary without per-test '
-        'details')
-    group.addoption(
-        '--json-report-indent', type=int, help='pretty-print JSON with '
-        'specified indentation level')
-    group._addoption(
-        '--json-report-verbosity', type=int, help='set verbosity (default is '
-        'value of --verbosity)')
+    add_options(parser)
 
 
 def pytest_configure(config):
@@ -0,0 +1,289 @@
+"""Functions for reading reports incrementally.
+
+Reports are parsed piece by piece, so iterating over the tests of a report
+only needs memory for one test item at a time, regardless of the size of the
+report. Report documents, streamed reports (see `writer.StreamWriter`),
+compressed reports and compact reports (see `compact`) are supported.
+"""
+import io
+import json
+import lzma
+import os
+import re
+import zlib
+
+from .compact import expand_record
+from .writer import COMPRESSION_MODULES, open_report_file
+
+# Number of characters read from a report file at a time
+CHUNK_SIZE = 64 * 1024
+
+# Record types of the items in the top-level lists of a report document
+LIST_TYPES = {
+    'collectors': 'collector',
+    'tests': 'test',
+    'warnings': 'warning',
+}
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+# Raised when reading a compressed file which has been cut off
+_TRUNCATED_ERRORS = (EOFError, zlib.error, lzma.LZMAError)
+
+
+def iter_records(path):
+    """Iterate over the records of the report at `path`.
+
+    Yields `(type, record)` pairs. For a report document, a `collector`,
+    `test` or `warning` record is yielded for each item of the respective
+    top-level list and a `failure` record (with an `id` key) for each entry
+    of `failures`. All other top-level keys are yielded last, as a `summary`
+    record. The records of a streamed report are yielded as they are, without
+    their `type` key.
+
+    Compact reports are expanded to the standard format.
+    """
+    with _open(path) as f:
+        streamed = _Parser(f).first_key() == 'type'
+    if streamed:
+        return _iter_stream(path)
+    return _iter_document(path)
+
+
+def iter_tests(path, outcome=None, nodeid_prefix=None):
+    """Iterate over the test items of the report at `path`.
+
+    If `outcome` is given (a string or a collection of strings), only tests
+    with a matching outcome are included. If `nodeid_prefix` is given, only
+    tests whose node ID starts with it are included.
+    """
+    return _filter(path, 'test', outcome, nodeid_prefix)
+
+
+def iter_collectors(path, outcome=None, nodeid_prefix=None):
+    """Iterate over the collectors of the report at `path`.
+
+    Filters work like for `iter_tests()`.
+    """
+    return _filter(path, 'collector', outcome, nodeid_prefix)
+
+
+def iter_warnings(path):
+    """Iterate over the warnings of the report at `path`."""
+    return _filter(path, 'warning')
+
+
+def _filter(path, type_, outcome=None, nodeid_prefix=None):
+    if isinstance(outcome, str):
+        outcome = (outcome,)
+    for record_type, record in iter_records(path):
+        if record_type != type_:
+            continue
+        if outcome is not None and record['outcome'] not in outcome:
+            continue
+        if nodeid_prefix is not None and \
+           not record['nodeid'].startswith(nodeid_prefix):
+            continue
+        yield record
+
+
+def _open(path):
+    f = open_report_file(path, 'rb')
+    if os.path.splitext(path)[1].lower() in COMPRESSION_MODULES:
+        f = io.BufferedReader(_CutOffFile(f))
+    return io.TextIOWrapper(f, encoding='utf-8')
+
+
+class _CutOffFile(io.RawIOBase):
+    """Wrapper for the compressed file `f` which ends where the file has been
+    cut off (e.g. if the session writing it was killed) instead of raising an
+    error, like an uncompressed file does."""
+
+    def __init__(self, f):
+        io.RawIOBase.__init__(self)
+        self._file = f
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        try:
+            # Unlike `read()`, this returns the data before the cut
+            data = self._file.read1(len(b))
+        except _TRUNCATED_ERRORS:
+            return 0
+        b[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self._file.close()
+        io.RawIOBase.close(self)
+
+
+def _iter_stream(path):
+    strings = []
+    with _open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            # The last line is incomplete if the session was killed
+            except ValueError:
+                continue
+            type_ = record.pop('type', None)
+            if type_ == 'strings':
+                strings.extend(record['strings'])
+                continue
+            if strings:
+                record = expand_record(type_, record, strings)
+            yield type_, record
+
+
+def _iter_document(path):
+    summary = {}
+    # The string table of a compact report, which is only looked up once the
+    # first compact record is found (it's stored at the end of the report)
+    strings = None
+    with _open(path) as f:
+        parser = _Parser(f)
+        for key in parser.keys():
+            type_ = LIST_TYPES.get(key)
+            if type_ is None or parser.peek() != '[':
+                value = parser.value()
+                if key == 'failures' and isinstance(value, dict):
+                    for failure_id, failure in value.items():
+                        if strings is None and _is_compact('failure', failure):
+                            strings = _find_strings(path)
+                        if strings:
+                            failure = expand_record('failure', failure,
+                                                    strings)
+                        yield 'failure', dict(failure, id=failure_id)
+                elif key != 'strings':
+                    summary[key] = value
+                continue
+            for record in parser.items():
+                if strings is None and _is_compact(type_, record):
+                    strings = _find_strings(path)
+                if strings:
+                    record = expand_record(type_, record, strings)
+                yield type_, record
+    yield 'summary', summary
+
+
+def _is_compact(type_, record):
+    """Return whether `record` contains references into a string table."""
+    if type_ == 'warning':
+        value = record.get('when')
+    elif type_ == 'failure':
+        location = record.get('crash') or (record.get('traceback') or [{}])[0]
+        value = location.get('path')
+    else:
+        value = record.get('outcome')
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _find_strings(path):
+    """Return the string table of the compact report document at `path`."""
+    with _open(path) as f:
+        parser = _Parser(f)
+        for key in parser.keys():
+            if key == 'strings':
+                return parser.value()
+            parser.skip()
+    return []
+
+
+class _Parser:
+    """Incremental parser for the JSON document in the text file `f`."""
+
+    def __init__(self, f):
+        self._file = f
+        self._decoder = json.JSONDecoder()
+        self._buf = ''
+        self._pos = 0
+
+    def _read(self):
+        """Read more data into the buffer. Return False at the end of the
+        file."""
+        # Read at least as much as is buffered, so that parsing a large value
+        # takes linear time
+        data = self._file.read(max(CHUNK_SIZE, len(self._buf) - self._pos))
+        self._buf = self._buf[self._pos:] + data
+        self._pos = 0
+        return bool(data)
+
+    def peek(self):
+        """Return the next non-whitespace character (or '' at the end)."""
+        while True:
+            self._pos = _WHITESPACE.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._read():
+                return ''
+
+    def consume(self, char):
+        if self.peek() != char:
+            return False
+        self._pos += 1
+        return True
+
+    def expect(self, char):
+        if not self.consume(char):
+            raise ValueError('Expected {!r} but found {!r}'.format(
+                char, self.peek()))
+
+    def value(self):
+        """Parse the next JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except ValueError:
+                if not self._read():
+                    raise
+                continue
+            # A number at the end of the buffer may continue in the next chunk
+            if end == len(self._buf) and self._read():
+                continue
+            self._pos = end
+            return value
+
+    def skip(self):
+        """Skip the next JSON value, one item at a time if it's a list."""
+        if self.peek() != '[':
+            self.value()
+            return
+        for _ in self.items():
+            pass
+
+    def first_key(self):
+        """Return the first key of the object (if any)."""
+        if not self.consume('{') or self.peek() != '"':
+            return None
+        return self.value()
+
+    def keys(self):
+        """Iterate over the keys of an object. The value of each key must be
+        consumed before the next key is retrieved."""
+        self.expect('{')
+        if self.consume('}'):
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.consume('}'):
+                return
+            self.expect(',')
+
+    def items(self):
+        """Iterate over the items of a list."""
+        self.expect('[')
+        if self.consume(']'):
+            return
+        while True:
+            yield self.value()
+            if self.consume(']'):
+                return
+            self.expect(',')
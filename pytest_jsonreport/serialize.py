@@ -2,16 +2,25 @@
 
 """
 from collections import Counter
-import json
+import hashlib
+import re
 
+from .encoders import StdlibEncoder
 
-def serializable(obj):
-    """Return whether `obj` is JSON-serializable."""
-    try:
-        json.dumps(obj)
-    except (TypeError, OverflowError):
-        return False
-    return True
+# Names of the stages of a test run
+STAGES = ('setup', 'call', 'teardown')
+# Named selections of log record fields
+LOG_FIELD_PRESETS = {
+    'compact': ('name', 'msg', 'levelname', 'created', 'filename', 'lineno'),
+}
+# First line of the error representations of xdist workers, e.g. "[gw0] linux
+# -- Python 3.10.4 /usr/bin/python" (see `_pytest.reports.getworkerinfoline`)
+_WORKER_INFO_LINE = re.compile(r'\A\[[^\]\n]*\] [^\n]* -- Python [^\n]*\n')
+
+
+def serializable(obj, encoder=None):
+    """Return whether `obj` is JSON-serializable (using `encoder`)."""
+    return (encoder or StdlibEncoder()).serializable(obj)
 
 
 def make_collector(report, result):
@@ -89,6 +98,73 @@ def make_teststage(report, stdout, stderr, log, omit_traceback):
     return stage
 
 
+def make_log(records, fields):
+    """Return JSON-serializable log records from `records`, which are tuples
+    of the values of `fields`.
+
+    The tuples of collapsed records end with the repeat count and the time
+    of the last repeat (see `logs.LoggingHandler`).
+    """
+    fields = tuple(fields) + ('repeat_count', 'last_created')
+    return [dict(zip(fields, record)) for record in records]
+
+
+def text_size(text):
+    """Return the size of `text` in bytes when encoded as UTF-8."""
+    if text.isascii():
+        return len(text)
+    return len(text.encode('utf-8', 'surrogatepass'))
+
+
+def truncate(text, limit):
+    """Return `text` truncated to `limit` bytes (encoded as UTF-8) and the
+    number of bytes removed.
+
+    The start and end of the text are kept and a marker is inserted where
+    bytes were removed. Characters are never split, so slightly more bytes
+    may be removed.
+    """
+    if limit is None or text_size(text) <= limit:
+        return text, 0
+    data = text.encode('utf-8', 'surrogatepass')
+    tail = limit // 2
+    end = _char_boundary(data, limit - tail, -1)
+    start = _char_boundary(data, len(data) - tail, 1)
+    num_removed = start - end
+    return '{}\n[... {} bytes truncated ...]\n{}'.format(
+        data[:end].decode('utf-8', 'surrogatepass'), num_removed,
+        data[start:].decode('utf-8', 'surrogatepass')), num_removed
+
+
+def _char_boundary(data, pos, step):
+    """Return the first position from `pos` (moving by `step`) in the UTF-8
+    encoded `data` where a character starts."""
+    # Continuation bytes of multi-byte characters are 0b10xxxxxx
+    while 0 < pos < len(data) and data[pos] & 0xc0 == 0x80:
+        pos += step
+    return pos
+
+
+def make_failure(stage):
+    """Remove the failure details from the test `stage` and return them."""
+    return {key: stage.pop(key) for key in ('crash', 'traceback', 'longrepr')
+            if key in stage}
+
+
+def make_failure_id(failure, encoder=None):
+    """Return an ID which identifies the contents of `failure`.
+
+    The line naming the xdist worker is ignored, so that identical failures
+    on different workers get the same ID.
+    """
+    longrepr = failure.get('longrepr')
+    if longrepr:
+        longrepr = _WORKER_INFO_LINE.sub('', longrepr)
+    data = (encoder or StdlibEncoder()).dumps(
+        [failure.get('crash'), failure.get('traceback'), longrepr])
+    return hashlib.sha1(data).hexdigest()[:16]
+
+
 def make_fileloc(loc):
     """Return JSON-serializable file location representation.
 
@@ -103,7 +179,17 @@ def make_fileloc(loc):
 
 def make_summary(tests, **kwargs):
     """Return JSON-serializable test result summary."""
-    summary = Counter([t['outcome'] for t in tests.values()])
+    return make_outcome_summary([t['outcome'] for t in tests.values()],
+                                **kwargs)
+
+
+def make_outcome_summary(outcomes, **kwargs):
+    """Return JSON-serializable test result summary from `outcomes`.
+
+    `outcomes` is an iterable of test outcomes or a mapping of outcomes to
+    their counts.
+    """
+    summary = Counter(outcomes)
     summary['total'] = sum(summary.values())
     summary.update(kwargs)
     return summary
@@ -120,5 +206,11 @@ def make_warning(warning_message, when):
     }
 
 
+def warning_key(warning):
+    """Return the key by which identical JSON warnings are aggregated."""
+    return (warning['category'], warning['message'], warning['filename'],
+            warning['lineno'], warning['when'])
+
+
 def make_report(**kwargs):
     return dict(kwargs)
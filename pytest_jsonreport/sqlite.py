@@ -0,0 +1,251 @@
+"""Writing of reports to SQLite databases.
+
+Sessions, tests, stages, log records, warnings and deduplicated failures are
+stored in normalized tables (see `SCHEMA`). Nested values such as keywords,
+metadata or tracebacks are stored as JSON text, which can be queried with
+SQLite's JSON functions. A database can hold multiple sessions.
+"""
+from collections import OrderedDict
+import itertools
+import json
+import sqlite3
+
+from .serialize import STAGES
+from .writer import make_dirs
+
+# Number of finished tests which are inserted in one transaction
+BATCH_SIZE = 500
+# Seconds to wait for the transactions of other sessions writing to the same
+# database
+LOCK_TIMEOUT = 60
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    start REAL,
+    created REAL,
+    duration REAL,
+    exitcode INTEGER,
+    root TEXT,
+    environment TEXT,
+    summary TEXT
+);
+CREATE TABLE IF NOT EXISTS tests (
+    id INTEGER PRIMARY KEY,
+    session_id INTEGER NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+    nodeid TEXT NOT NULL,
+    lineno INTEGER,
+    outcome TEXT NOT NULL,
+    duration REAL,
+    keywords TEXT,
+    metadata TEXT,
+    user_properties TEXT
+);
+CREATE TABLE IF NOT EXISTS stages (
+    id INTEGER PRIMARY KEY,
+    test_id INTEGER NOT NULL REFERENCES tests (id) ON DELETE CASCADE,
+    stage TEXT NOT NULL,
+    outcome TEXT,
+    duration REAL,
+    longrepr TEXT,
+    stdout TEXT,
+    stderr TEXT,
+    crash TEXT,
+    traceback TEXT,
+    failure_id TEXT,
+    truncated TEXT
+);
+CREATE TABLE IF NOT EXISTS logs (
+    id INTEGER PRIMARY KEY,
+    stage_id INTEGER NOT NULL REFERENCES stages (id) ON DELETE CASCADE,
+    name TEXT,
+    levelname TEXT,
+    msg TEXT,
+    created REAL,
+    record TEXT
+);
+CREATE TABLE IF NOT EXISTS warnings (
+    id INTEGER PRIMARY KEY,
+    session_id INTEGER NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+    message TEXT,
+    category TEXT,
+    "when" TEXT,
+    filename TEXT,
+    lineno INTEGER
+);
+CREATE TABLE IF NOT EXISTS failures (
+    session_id INTEGER NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+    id TEXT NOT NULL,
+    crash TEXT,
+    traceback TEXT,
+    longrepr TEXT,
+    PRIMARY KEY (session_id, id)
+);
+CREATE INDEX IF NOT EXISTS tests_session_id ON tests (session_id);
+CREATE INDEX IF NOT EXISTS tests_nodeid ON tests (nodeid);
+CREATE INDEX IF NOT EXISTS tests_outcome ON tests (outcome);
+CREATE INDEX IF NOT EXISTS tests_duration ON tests (duration);
+CREATE INDEX IF NOT EXISTS stages_test_id ON stages (test_id);
+CREATE INDEX IF NOT EXISTS logs_stage_id ON logs (stage_id);
+CREATE INDEX IF NOT EXISTS warnings_session_id ON warnings (session_id);
+'''
+
+
+class SQLiteWriter:
+    """Write the tests of a session to the SQLite database at `path`.
+
+    Finished tests are added with `add_test()` and inserted in batches of
+    `BATCH_SIZE`. If a test is added again (e.g. when it's rerun), its
+    earlier rows are replaced.
+    """
+
+    def __init__(self, path, start=None):
+        make_dirs(path)
+        # The writer may be used from a background thread (see
+        # `writer.BackgroundWriter`), but never concurrently
+        self._conn = sqlite3.connect(path, timeout=LOCK_TIMEOUT,
+                                     check_same_thread=False)
+        self._conn.execute('PRAGMA foreign_keys = ON')
+        with self._conn:
+            self._conn.executescript(SCHEMA)
+            self._session_id = self._conn.execute(
+                'INSERT INTO sessions (start) VALUES (?)', (start,)).lastrowid
+        # Node ID -> rows (without IDs) of tests which haven't been inserted
+        # yet
+        self._pending = OrderedDict()
+        self._pending_warnings = []
+        self._pending_failures = []
+        # Node IDs of inserted tests
+        self._inserted = set()
+
+    def has_test(self, nodeid):
+        return nodeid in self._pending or nodeid in self._inserted
+
+    def add_test(self, test):
+        """Add the JSON `test` item (see `serialize.make_testitem`)."""
+        duration = sum(test[when].get('duration', 0) for when in STAGES if
+                       when in test)
+        test_row = (self._session_id, test['nodeid'], test.get('lineno'),
+                    test['outcome'], duration, _json(test.get('keywords')),
+                    _json(test.get('metadata')),
+                    _json(test.get('user_properties')))
+        stages = []
+        for when in STAGES:
+            stage = test.get(when)
+            if stage is None:
+                continue
+            stage_row = (
+                when, stage.get('outcome'), stage.get('duration'),
+                stage.get('longrepr'), stage.get('stdout'),
+                stage.get('stderr'), _json(stage.get('crash')),
+                _json(stage.get('traceback')), stage.get('failure'),
+                _json(stage.get('truncated')))
+            log_rows = [
+                (record.get('name'), record.get('levelname'),
+                 record.get('msg'), record.get('created'), _json(record))
+                for record in stage.get('log', [])]
+            stages.append((stage_row, log_rows))
+        # Replaces the rows of an earlier, pending run of the same test
+        self._pending.pop(test['nodeid'], None)
+        self._pending[test['nodeid']] = (test_row, stages)
+        if len(self._pending) >= BATCH_SIZE:
+            self.flush()
+
+    def add_warning(self, warning):
+        """Add the JSON `warning` (see `serialize.make_warning`)."""
+        self._pending_warnings.append((
+            self._session_id, warning.get('message'), warning.get('category'),
+            warning.get('when'), warning.get('filename'),
+            warning.get('lineno')))
+        # Warnings may be issued in a loop
+        if len(self._pending_warnings) >= BATCH_SIZE:
+            self.flush()
+
+    def add_failure(self, failure_id, failure):
+        """Add a deduplicated `failure` (see `serialize.make_failure`)."""
+        self._pending_failures.append((
+            self._session_id, failure_id, _json(failure.get('crash')),
+            _json(failure.get('traceback')), failure.get('longrepr')))
+
+    def flush(self):
+        """Insert all pending rows in a single transaction."""
+        with self._conn:
+            # Takes the write lock right away, so no other session can insert
+            # rows between allocating the IDs and inserting the rows
+            self._conn.execute('BEGIN IMMEDIATE')
+            self._conn.executemany(
+                'DELETE FROM tests WHERE session_id = ? AND nodeid = ?',
+                [(self._session_id, nodeid) for nodeid in self._pending if
+                 nodeid in self._inserted])
+            test_rows, stage_rows, log_rows = self._number_rows()
+            self._conn.executemany(
+                'INSERT INTO tests VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                test_rows)
+            self._conn.executemany(
+                'INSERT INTO stages VALUES '
+                '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', stage_rows)
+            self._conn.executemany(
+                'INSERT INTO logs VALUES (?, ?, ?, ?, ?, ?, ?)', log_rows)
+            self._conn.executemany(
+                'INSERT INTO warnings (session_id, message, category, "when", '
+                'filename, lineno) VALUES (?, ?, ?, ?, ?, ?)',
+                self._pending_warnings)
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO failures VALUES (?, ?, ?, ?, ?)',
+                self._pending_failures)
+        self._inserted.update(self._pending)
+        self._pending.clear()
+        del self._pending_warnings[:]
+        del self._pending_failures[:]
+
+    def _number_rows(self):
+        """Return the pending test, stage and log rows with the IDs of the
+        rows and the IDs of the rows they reference.
+
+        IDs are assigned explicitly (instead of by SQLite), so the rows of a
+        batch can be inserted with one statement per table. This must be
+        called while holding the write lock of the database.
+        """
+        test_ids, stage_ids, log_ids = (
+            itertools.count(self._conn.execute(
+                'SELECT COALESCE(MAX(id), 0) + 1 FROM ' + table).fetchone()[0])
+            for table in ('tests', 'stages', 'logs'))
+        test_rows, stage_rows, log_rows = [], [], []
+        for test_row, stages in self._pending.values():
+            test_id = next(test_ids)
+            test_rows.append((test_id,) + test_row)
+            for stage_row, stage_log_rows in stages:
+                stage_id = next(stage_ids)
+                stage_rows.append((stage_id, test_id) + stage_row)
+                log_rows.extend((next(log_ids), stage_id) + row for row in
+                                stage_log_rows)
+        return test_rows, stage_rows, log_rows
+
+    def close(self, report):
+        """Insert all pending rows, add the session data of the JSON `report`
+        (see `serialize.make_report`) and close the database."""
+        self.flush()
+        with self._conn:
+            self._conn.execute(
+                'UPDATE sessions SET created = ?, duration = ?, exitcode = ?, '
+                'root = ?, environment = ?, summary = ? WHERE id = ?',
+                (report.get('created'), report.get('duration'),
+                 _int(report.get('exitcode')), report.get('root'),
+                 _json(report.get('environment')),
+                 _json(report.get('summary')), self._session_id))
+        self._conn.close()
+
+    def abort(self):
+        """Close the database without inserting the pending rows."""
+        self._conn.close()
+
+
+def _int(value):
+    # Exit codes may be enums
+    return None if value is None else int(value)
+
+
+def _json(value):
+    if value is None:
+        return None
+    return json.dumps(value, default=str)
@@ -0,0 +1,122 @@
+"""Profiling of the plugin's own overhead (see `--json-report-profile`)."""
+from collections import OrderedDict
+from contextlib import contextmanager
+import functools
+import threading
+from time import perf_counter
+
+
+class PluginStats:
+    """Call counts and times of the plugin's operations.
+
+    Operations can be nested. The self time of an operation excludes the time
+    spent in nested operations of the same thread, so the self times add up
+    to the total overhead. Operations may be measured on any thread (e.g. log
+    records are emitted by the threads of the tests).
+    """
+
+    def __init__(self):
+        # Name -> [calls, self time, total time]
+        self._stats = {}
+        self._lock = threading.Lock()
+        # The `nested` attribute holds the time spent in nested operations
+        # of each running operation of a thread
+        self._local = threading.local()
+
+    @contextmanager
+    def measure(self, name, calls=1):
+        """Measure the time of the operation `name` while in the context and
+        count it as `calls` calls."""
+        try:
+            nested_times = self._local.nested
+        except AttributeError:
+            nested_times = self._local.nested = []
+        nested_times.append(0.0)
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - start
+            nested = nested_times.pop()
+            if nested_times:
+                nested_times[-1] += elapsed
+            self._add(name, calls, elapsed - nested, elapsed)
+
+    def wrap(self, name, func):
+        """Return `func` wrapped to measure its calls as operation `name`."""
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.measure(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def _add(self, name, calls, self_time, total_time):
+        with self._lock:
+            stat = self._stats.setdefault(name, [0, 0.0, 0.0])
+            stat[0] += calls
+            stat[1] += self_time
+            stat[2] += total_time
+
+    def update(self, stats):
+        """Add the `stats` of another instance (as returned by `to_dict()`),
+        e.g. of an xdist worker."""
+        for name, stat in stats.items():
+            self._add(name, stat['calls'], stat['self_time'],
+                      stat['total_time'])
+
+    def total(self):
+        """Return the total time of all operations."""
+        return sum(stat[1] for stat in self._stats.values())
+
+    def to_dict(self):
+        """Return the stats by operation, ordered by self time."""
+        return OrderedDict(
+            (name, {'calls': calls, 'self_time': self_time,
+                    'total_time': total_time}) for
+            name, (calls, self_time, total_time) in
+            sorted(self._stats.items(), key=lambda item: -item[1][1]))
+
+    def summary_lines(self, num_tests):
+        """Return the lines of the terminal summary of the stats of a session
+        which ran `num_tests` tests."""
+        total = self.total()
+        lines = ['plugin overhead: {:.3f}s ({:.1f}us per test)'.format(
+            total, total / num_tests * 1e6 if num_tests else 0)]
+        for name, stat in self.to_dict().items():
+            lines.append('  {:<36} {:>8} calls {:>10.4f}s'.format(
+                name, stat['calls'], stat['self_time']))
+        return lines
+
+
+def instrument_hooks(stats, pluginmanager, plugin):
+    """Measure the calls of the hook implementations of the registered
+    `plugin` as operations named after the hooks."""
+    for caller in pluginmanager.get_hookcallers(plugin) or []:
+        for impl in caller.get_hookimpls():
+            if impl.plugin is not plugin or getattr(impl, 'wrapper', False):
+                continue
+            if impl.hookwrapper:
+                impl.function = _wrap_hookwrapper(stats, caller.name,
+                                                  impl.function)
+            else:
+                impl.function = stats.wrap(caller.name, impl.function)
+
+
+def _wrap_hookwrapper(stats, name, func):
+    # Only the code before and after the `yield` of a hook wrapper counts
+    @functools.wraps(func)
+    def wrapper(*args):
+        gen = func(*args)
+        with stats.measure(name):
+            try:
+                next(gen)
+            # Let pluggy report a hook wrapper which doesn't yield
+            except StopIteration:
+                return
+        outcome = yield
+        with stats.measure(name, calls=0):
+            try:
+                gen.send(outcome)
+            except StopIteration:
+                pass
+    return wrapper
@@ -0,0 +1,222 @@
+"""Stores for the JSON test items of a session.
+
+A store maps node IDs to test items (see `serialize.make_testitem`). Items
+are added when the first stage of a test is reported and marked finished
+after the last stage.
+"""
+from collections import OrderedDict
+import tempfile
+import threading
+
+from .encoders import StdlibEncoder
+from .writer import Encoded
+
+
+class MemoryTestStore:
+    """Keep all test items in memory."""
+
+    def __init__(self, encoder=None, writer=None, indent=None):
+        self._tests = OrderedDict()
+
+    def __len__(self):
+        return len(self._tests)
+
+    def __iter__(self):
+        return iter(self._tests)
+
+    def get(self, nodeid):
+        """Return the test item of `nodeid` or None if there is none."""
+        return self._tests.get(nodeid)
+
+    def add(self, nodeid, item):
+        self._tests[nodeid] = item
+
+    def finish(self, nodeid):
+        """Mark the test item of `nodeid` as complete.
+
+        The item may still be retrieved (and changed) again later, e.g. when
+        a test is rerun.
+        """
+
+    def pop(self, nodeid):
+        return self._tests.pop(nodeid)
+
+    def outcomes(self):
+        return (item['outcome'] for item in self._tests.values())
+
+    def values(self):
+        return iter(self._tests.values())
+
+    def tests(self):
+        """Return the test items to be used in the report."""
+        return list(self._tests.values())
+
+
+class DiskTestStore(MemoryTestStore):
+    """Keep finished test items in a temporary file.
+
+    Only unfinished items are held in memory. Finished items are appended to
+    the file as JSON and loaded again when they're retrieved, so memory usage
+    doesn't grow with the size of the items.
+
+    If a `writer.BackgroundWriter` is given, finished items are encoded and
+    written on its thread. Items which are retrieved again before that
+    happened (e.g. when a test is rerun) stay in memory. Flush the writer
+    before iterating over the items.
+
+    Items are encoded with `indent`, so a report with the same encoder and
+    indentation can be written without decoding them again (see
+    `StoredTests.encoded()`).
+    """
+
+    def __init__(self, encoder=None, writer=None, indent=None):
+        MemoryTestStore.__init__(self)
+        self._encoder = encoder or StdlibEncoder()
+        self._writer = writer
+        self._indent = indent
+        # Guards the items and the file against the writer thread
+        self._lock = threading.Lock()
+        # Node ID -> finished items which are queued to be written
+        self._queued = {}
+        # pylint: disable=consider-using-with
+        self._file = tempfile.TemporaryFile()
+        self._size = 0
+
+    def get(self, nodeid):
+        with self._lock:
+            # The item may change again, so it must not be written
+            self._queued.pop(nodeid, None)
+            item = self._tests.get(nodeid)
+            if isinstance(item, _Location):
+                item = self._tests[nodeid] = self._load(item)
+        return item
+
+    def finish(self, nodeid):
+        item = self._tests[nodeid]
+        if isinstance(item, _Location):
+            return
+        if self._writer is None:
+            self._write(nodeid, item, item)
+            return
+        with self._lock:
+            self._queued[nodeid] = item
+        # A copy, since the item may change if the test is rerun before it's
+        # written
+        self._writer.submit(self._write, nodeid, item, dict(item))
+
+    def _write(self, nodeid, item, copy):
+        data = self._encoder.dumps(copy, indent=self._indent)
+        with self._lock:
+            if self._writer is not None and \
+               self._queued.pop(nodeid, None) is not item:
+                return
+            # Reading may have moved the file position
+            self._file.seek(self._size)
+            self._file.write(data)
+            self._tests[nodeid] = _Location(self._size, len(data),
+                                            item['outcome'])
+            self._size += len(data)
+
+    def pop(self, nodeid):
+        with self._lock:
+            self._queued.pop(nodeid, None)
+            item = self._tests.pop(nodeid)
+            if isinstance(item, _Location):
+                item = self._load(item)
+        return item
+
+    def outcomes(self):
+        return (item.outcome if isinstance(item, _Location) else
+                item['outcome'] for item in self._tests.values())
+
+    def values(self, encoded=False):
+        """Yield the test items.
+
+        If `encoded` is true, finished items are yielded as they were encoded
+        (see `EncodedTest`).
+        """
+        for nodeid, item in list(self._tests.items()):
+            if isinstance(item, _Location):
+                with self._lock:
+                    if encoded:
+                        item = EncodedTest(self._read(item), nodeid,
+                                           item.outcome)
+                    else:
+                        item = self._load(item)
+            yield item
+
+    def tests(self):
+        return StoredTests(self)
+
+    def encoded_with(self, encoder, indent):
+        """Return whether the items are encoded like `encoder` encodes them
+        with `indent`."""
+        return encoder is self._encoder and indent == self._indent
+
+    def _load(self, location):
+        return self._encoder.loads(self._read(location))
+
+    def _read(self, location):
+        self._file.seek(location.offset)
+        return self._file.read(location.length)
+
+
+class _Location:
+    """Location of a finished test item in the file of a `DiskTestStore`."""
+
+    __slots__ = ('offset', 'length', 'outcome')
+
+    def __init__(self, offset, length, outcome):
+        self.offset = offset
+        self.length = length
+        self.outcome = outcome
+
+
+class EncodedTest(Encoded):
+    """A test item as it was encoded, with the node ID and outcome of the
+    test."""
+
+    def __new__(cls, data, nodeid, outcome):
+        self = Encoded.__new__(cls, data)
+        self.nodeid = nodeid
+        self.outcome = outcome
+        return self
+
+
+class StoredTests:
+    """Read-only, lazily loaded list of the test items in a store.
+
+    Items are loaded from the store on every iteration, so changes to them
+    aren't persisted.
+    """
+
+    def __init__(self, store, encoded=False):
+        self._store = store
+        self._encoded = encoded
+
+    def __len__(self):
+        return len(self._store)
+
+    def __iter__(self):
+        return self._store.values(self._encoded)
+
+    def encoded(self, encoder, indent):
+        """Return the items for `writer.dump_report()` with `encoder` and
+        `indent`.
+
+        If the store encoded the items the same way, finished items are
+        passed on as they were encoded (see `EncodedTest`) instead of being
+        decoded and encoded again.
+        """
+        if not self._store.encoded_with(encoder, indent):
+            return self
+        return StoredTests(self._store, encoded=True)
+
+    def __repr__(self):
+        return '<StoredTests ({} items)>'.format(len(self))
+
+
+STORES = {
+    'memory': MemoryTestStore,
+    'disk': DiskTestStore,
+}
@@ -0,0 +1,281 @@
+"""Functions and classes for writing reports to files.
+
+"""
+from collections.abc import Iterable
+from contextlib import contextmanager
+import importlib
+import os
+import queue
+import threading
+import uuid
+
+from .compact import StringTable, compact_record
+from .encoders import StdlibEncoder
+
+
+def make_dirs(path):
+    """Create the parent directories of `path` if they don't exist."""
+    dirname = os.path.dirname(path)
+    if not dirname:
+        return
+    try:
+        os.makedirs(dirname)
+    # Mimick FileExistsError for py2.7 compatibility
+    except OSError as e:
+        import errno  # pylint: disable=import-outside-toplevel
+        if e.errno != errno.EEXIST:
+            raise
+
+
+# Compression modules by file name suffix
+COMPRESSION_MODULES = {
+    '.gz': 'gzip',
+    '.bz2': 'bz2',
+    '.xz': 'lzma',
+}
+
+
+def open_report_file(path, mode='rb'):
+    """Open the report file at `path` in binary `mode`.
+
+    If the file name ends with one of the suffixes in `COMPRESSION_MODULES`,
+    the file is transparently (de)compressed while reading or writing.
+    """
+    module_name = COMPRESSION_MODULES.get(os.path.splitext(path)[1].lower())
+    if module_name is None:
+        return open(path, mode)  # pylint: disable=consider-using-with
+    return importlib.import_module(module_name).open(path, mode)
+
+
+# Buffer size for writing reports, which are written in many small pieces
+BUFFER_SIZE = 1024 * 1024
+
+
+@contextmanager
+def atomic_report_file(path, fsync=False):
+    """Open a temporary file for writing the report at `path` in binary mode
+    (compressed like `open_report_file()` does).
+
+    The temporary file is in the same directory and replaces the file at
+    `path` once it's been written completely, so readers never see a
+    partially written report. If an exception occurs, the temporary file is
+    removed. If `fsync` is true, the file and the directory entry are
+    flushed to disk, so the report survives a system crash.
+    """
+    dirname, basename = os.path.split(path)
+    temp_path = os.path.join(dirname, '.{}.{}.tmp'.format(
+        basename, uuid.uuid4().hex[:12]))
+    module_name = COMPRESSION_MODULES.get(os.path.splitext(path)[1].lower())
+    try:
+        # Unlike `tempfile.mkstemp()`, this keeps the default permissions
+        with open(temp_path, 'xb', buffering=BUFFER_SIZE) as f:
+            if module_name is None:
+                yield f
+            else:
+                with _compressed_file(f, module_name, basename) as \
+                        compressed_file:
+                    yield compressed_file
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    if fsync:
+        _fsync_dir(dirname or '.')
+
+
+def _compressed_file(f, module_name, basename):
+    """Return a file which writes to the binary file `f` compressed with
+    the module `module_name`, for the file name `basename`."""
+    module = importlib.import_module(module_name)
+    if module_name == 'gzip':
+        # The header holds the original file name (the name without .gz),
+        # which would otherwise be taken from `f`, i.e. the temporary file
+        return module.GzipFile(filename=basename, mode='wb', fileobj=f)
+    return module.open(f, 'wb')
+
+
+def _fsync_dir(path):
+    """Flush the entries of the directory at `path` to disk if possible."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    # Directories can't be opened on Windows
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    # Not supported by all file systems
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def dump_report(report, f, indent=None, encoder=None, on_item=None):
+    """Write `report` as a JSON document to the binary file `f`.
+
+    With the stdlib encoder, the output is the same as from `json.dump()`.
+    However, lists and other iterable values of the report (e.g.
+    `store.StoredTests`) are encoded and written one item at a time, so their
+    encoded form never needs to be held in memory as a whole.
+
+    Items of top-level lists which are `Encoded` are written as they are, so
+    they must have been encoded with the same `indent`.
+
+    If given, `on_item(key, item, offset, length)` is called for every item
+    written of a top-level list, where `offset` and `length` locate the
+    encoded item in the written bytes (e.g. see `index.IndexBuilder`).
+    """
+    if encoder is None:
+        encoder = StdlibEncoder()
+    if indent is None:
+        newline, separator = b'', b', '
+    else:
+        newline, separator = b'\n' + b' ' * indent, b','
+    # Prefix for the lines of items in top-level lists
+    item_newline = newline + newline[1:]
+    out = _DumpWriter(f, encoder, indent)
+    out.write(b'{')
+    for i, (key, value) in enumerate(report.items()):
+        out.write(b''.join([separator if i else b'', newline,
+                            out.encode(str(key), newline), b': ']))
+        if not _is_list(value):
+            out.write(out.encode(value, newline))
+            continue
+        out.write(b'[')
+        empty = True
+        for item in value:
+            out.write(item_newline if empty else separator + item_newline)
+            data = out.encode(item, item_newline)
+            if on_item is not None:
+                on_item(key, item, out.pos, len(data))
+            out.write(data)
+            empty = False
+        out.write(b']' if empty else newline + b']')
+    out.write(b'}' if not report or indent is None else b'\n}')
+
+
+class _DumpWriter:
+    """Encodes values for `dump_report()` and writes them to a file, counting
+    the bytes written so far in `pos`."""
+
+    def __init__(self, f, encoder, indent):
+        self._file = f
+        self._encoder = encoder
+        self._indent = indent
+        self.pos = 0
+
+    def encode(self, obj, newline):
+        if not isinstance(obj, Encoded):
+            obj = self._encoder.dumps(obj, indent=self._indent)
+        return obj.replace(b'\n', newline)
+
+    def write(self, data):
+        self._file.write(data)
+        self.pos += len(data)
+
+
+class Encoded(bytes):
+    """A value which has already been encoded (see `dump_report()`)."""
+
+
+def _is_list(value):
+    return isinstance(value, Iterable) and \
+        not isinstance(value, (str, bytes, dict))
+
+
+class BackgroundWriter:
+    """Run write operations in order on a background thread.
+
+    Operations are queued with `submit()`. At most `max_pending` operations
+    are queued; if the queue is full, `submit()` blocks until the thread has
+    caught up, so memory usage stays bounded if writing is slower than
+    running the tests. If an operation raises an exception, it's re-raised
+    by the next call of `submit()`, `flush()` or `close()`, and the
+    operations queued until then are skipped.
+    """
+
+    def __init__(self, max_pending=1000):
+        self._queue = queue.Queue(max_pending)
+        self._error = None
+        self._thread = threading.Thread(
+            target=self._run, name='json-report-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, func, *args):
+        """Queue the call `func(*args)`."""
+        self._raise_error()
+        self._queue.put((func, args))
+
+    def flush(self):
+        """Wait until all queued operations are done."""
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        """Run the queued operations and stop the thread."""
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _run(self):
+        while True:
+            task = self._queue.get()
+            try:
+                if task is None:
+                    return
+                func, args = task
+                if self._error is None:
+                    func(*args)
+            except Exception as e:  # pylint: disable=broad-except
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+
+class StreamWriter:
+    """Write a report as newline-delimited JSON (one record per line).
+
+    Every record is a JSON object with a `type` key (`header`, `collector`,
+    `test`, `warning`, `failure` or `summary`). Records are flushed as soon
+    as they're written, so the file always holds a valid prefix of the
+    report.
+
+    If `compact` is true, records are written in the compact format (see
+    `compact`), with new strings written as `strings` records.
+    """
+
+    def __init__(self, path, encoder=None, compact=False):
+        make_dirs(path)
+        self._file = open_report_file(path, 'wb')
+        self._encoder = encoder or StdlibEncoder()
+        self._table = StringTable() if compact else None
+        self._num_strings = 0
+
+    def write(self, type_, data):
+        if self._table is not None:
+            data = compact_record(type_, data, self._table)
+            if len(self._table.strings) > self._num_strings:
+                self._write_record('strings', {
+                    'strings': self._table.strings[self._num_strings:]})
+                self._num_strings = len(self._table.strings)
+        self._write_record(type_, data)
+        self._file.flush()
+
+    def _write_record(self, type_, data):
+        record = {'type': type_}
+        record.update(data)
+        self._file.write(self._encoder.dumps(record) + b'\n')
+
+    def close(self):
+        self._file.close()
@@ -113,10 +113,12 @@ def num_processes(request):
 @pytest.fixture
 def make_json(num_processes, testdir):
     def func(content=FILE, args=['-vv', '--json-report', '-n=%d' %
-             num_processes], path='.report.json'):
+             num_processes], path='.report.json', parse=True):
         testdir.makepyfile(content)
         testdir.runpytest(*args)
         with open(str(testdir.tmpdir / path)) as f:
+            if not parse:
+                return f.read()
             data = json.load(f)
         return data
     return func
@@ -1,10 +1,30 @@
+import enum
+import io
+import json
 import logging
+import operator
 import os.path
+import sqlite3
 import sys
+import threading
+import time
 import pytest
 
+from pytest_jsonreport import reader
+from pytest_jsonreport.__main__ import main
+from pytest_jsonreport.columnar import Columns, load_columns
+from pytest_jsonreport.compact import (
+    compact_report, expand_record, expand_report)
+from pytest_jsonreport.encoders import ENCODERS, StdlibEncoder, get_encoder
+from pytest_jsonreport.index import ReportIndex
 from pytest_jsonreport.plugin import JSONReport
-from .conftest import tests_only, FILE
+from pytest_jsonreport.sqlite import SQLiteWriter
+from pytest_jsonreport.stats import PluginStats
+from pytest_jsonreport.store import DiskTestStore
+from pytest_jsonreport.writer import (
+    BackgroundWriter, StreamWriter, atomic_report_file, dump_report,
+    open_report_file)
+from .conftest import normalize_report, tests_only, FILE
 
 
 def test_arguments_in_help(misc_testdir):
@@ -258,12 +278,336 @@ def test_no_streams(make_json):
     assert 'stderr' not in call
 
 
-def test_summary_only(make_json):
-    data = make_json(FILE, ['--json-report', '--json-report-summary'])
-    assert 'summary' in data
+def test_summary_only(make_json, num_processes):
+    args = ['--json-report', '-n=%d' % num_processes]
+    full = make_json(FILE, args)
+    data = make_json(FILE, args + ['--json-report-summary'])
+    assert data['summary'] == full['summary']
     assert 'tests' not in data
     assert 'collectors' not in data
     assert 'warnings' not in data
+    # A rerun test is only counted once
+    rerun = '''
+        from flaky import flaky
+
+        FLAKY_RUNS = 0
+
+        @flaky
+        def test_flaky():
+            global FLAKY_RUNS
+            FLAKY_RUNS += 1
+            assert FLAKY_RUNS == 2
+
+        def test_pass():
+            pass
+    '''
+    full = make_json(rerun, args)
+    data = make_json(rerun, args + ['--json-report-summary'])
+    assert data['summary'] == full['summary']
+    assert data['summary']['total'] == data['summary']['collected']
+
+
+def test_stream(make_json, num_processes):
+    data = make_json("""
+        import json
+
+        def test_first():
+            assert False
+
+        def test_second():
+            with open('.report.json') as f:
+                records = [json.loads(line) for line in f]
+            assert records[0]['type'] == 'header'
+    """, ['--json-report', '--json-report-stream', '-n=%d' % num_processes],
+                     parse=False)
+    records = [json.loads(line) for line in data.splitlines()]
+    types = [r.pop('type') for r in records]
+    assert types[0] == 'header'
+    assert types[-1] == 'summary'
+    assert set(records[0]) == {'start', 'root', 'environment'}
+    tests_ = {r['nodeid'].split('::')[-1]: r for r, t in zip(records, types)
+              if t == 'test'}
+    assert tests_['test_first']['outcome'] == 'failed'
+    assert tests_['test_second']['outcome'] == 'passed'
+    assert 'tests' not in records[-1]
+    assert records[-1]['summary'] == {
+        'passed': 1, 'failed': 1, 'total': 2, 'collected': 2}
+    # A rerun test is written once per run, but only counted once
+    rerun = '''
+        from flaky import flaky
+
+        FLAKY_RUNS = 0
+
+        @flaky
+        def test_flaky():
+            global FLAKY_RUNS
+            FLAKY_RUNS += 1
+            assert FLAKY_RUNS == 2
+    '''
+    args = ['--json-report', '-n=%d' % num_processes]
+    full = make_json(rerun, args)
+    data = make_json(rerun, args + ['--json-report-stream'], parse=False)
+    records = [json.loads(line) for line in data.splitlines()]
+    assert records[-1]['summary'] == full['summary']
+
+
+@pytest.mark.parametrize('summary', [False, True])
+def test_checkpoint(make_json, num_processes, summary):
+    args = ['--json-report', '-n=%d' % num_processes,
+            '--json-report-checkpoint-interval=0.05']
+    if summary:
+        args.append('--json-report-summary')
+    data = make_json("""
+        import json
+        import time
+
+        def test_first():
+            assert False
+
+        def test_second():
+            # Wait for a checkpoint with the first test
+            for _ in range(100):
+                try:
+                    with open('.report.json') as f:
+                        data = json.load(f)
+                except IOError:
+                    data = {}
+                if data.get('summary', {}).get('total'):
+                    break
+                time.sleep(0.05)
+            assert data['exitcode'] is None
+            assert data['summary']['failed'] == 1
+            assert data['summary']['collected'] == 2
+            if 'tests' in data:
+                assert [t['outcome'] for t in data['tests']] == ['failed']
+    """, args)
+    assert data['exitcode'] == 1
+    assert data['summary'] == {
+        'passed': 1, 'failed': 1, 'total': 2, 'collected': 2}
+    assert ('tests' in data) is not summary
+
+
+@pytest.mark.parametrize('interval', ['0', '-1', 'inf'])
+def test_checkpoint_invalid_interval(misc_testdir, interval):
+    res = misc_testdir.runpytest(
+        '--json-report', '--json-report-checkpoint-interval=' + interval)
+    assert res.ret == 4
+    res.stderr.fnmatch_lines(['*must be a positive number of seconds*'])
+
+
+def test_details_failed(make_json, num_processes):
+    data = make_json("""
+        import logging
+        import pytest
+
+        @pytest.fixture
+        def fixture():
+            print('setup')
+            yield
+            print('teardown')
+
+        def test_pass(fixture):
+            print('call')
+            logging.error('log error')
+
+        def test_fail(fixture):
+            print('call')
+            logging.error('log error')
+            assert False
+    """, ['--json-report', '-n=%d' % num_processes,
+          '--json-report-details=failed'])
+    tests_ = tests_only(data)
+    for stage in ('setup', 'call', 'teardown'):
+        assert not {'stdout', 'stderr', 'log'} & set(tests_['pass'][stage])
+    test = tests_['fail']
+    # Details of the setup stage are added once the test fails
+    assert test['setup']['stdout'] == 'setup\n'
+    assert test['call']['stdout'] == 'call\n'
+    assert test['call']['log'][0]['msg'] == 'log error'
+    assert test['teardown']['stdout'] == 'teardown\n'
+
+
+def test_xdist_shards(make_json, num_processes):
+    content = """
+        import logging
+        import pytest
+
+        @pytest.fixture
+        def fixture():
+            print('setup')
+            yield
+            print('teardown')
+
+        def test_pass(json_metadata, fixture):
+            json_metadata['foo'] = 1
+            print('call')
+            logging.error('log error')
+
+        def test_fail(fixture):
+            print('call')
+            assert False
+    """
+    args = ['--json-report', '-n=%d' % num_processes,
+            '--json-report-xdist-shards']
+    tests_ = tests_only(make_json(content, args))
+    assert tests_['pass']['metadata'] == {'foo': 1}
+    assert tests_['pass']['call']['log'][0]['msg'] == 'log error'
+    for test in tests_.values():
+        assert test['setup']['stdout'] == 'setup\n'
+        assert test['call']['stdout'] == 'call\n'
+        assert test['teardown']['stdout'] == 'teardown\n'
+    assert tests_['fail']['call']['crash']
+
+    tests_ = tests_only(make_json(
+        content, args + ['--json-report-details=failed']))
+    assert tests_['pass']['metadata'] == {'foo': 1}
+    assert 'stdout' not in tests_['pass']['call']
+    assert tests_['fail']['setup']['stdout'] == 'setup\n'
+
+
+def test_details_none(make_json, num_processes):
+    data = make_json("""
+        import logging
+        def test_foo():
+            print('foo')
+            logging.error('log error')
+            assert False
+    """, ['--json-report', '-n=%d' % num_processes,
+          '--json-report-details=none'])
+    call = data['tests'][0]['call']
+    assert 'stdout' not in call
+    assert 'log' not in call
+    assert 'longrepr' in call
+
+
+def test_dedupe_failures(make_json, num_processes):
+    data = make_json("""
+        import pytest
+
+        @pytest.fixture
+        def broken():
+            raise RuntimeError('broken')
+
+        @pytest.mark.parametrize('x', range(5))
+        def test_broken(broken, x):
+            pass
+
+        def test_fail():
+            assert False
+
+        @pytest.mark.xfail
+        def test_xfail():
+            assert False
+
+        @pytest.mark.skip(reason='skipped')
+        def test_skip():
+            pass
+    """, ['--json-report', '-n=%d' % num_processes,
+          '--json-report-dedupe-failures'])
+    failures = data['failures']
+    tests_ = tests_only(data)
+    # With xdist, the worker named in the error representation doesn't count
+    failure_id, = {tests_['broken[%d]' % x]['setup']['failure'] for x in
+                   range(5)}
+    failure = failures[failure_id]
+    assert set(failure) == {'crash', 'traceback', 'longrepr'}
+    assert failure['crash']['message'] == 'RuntimeError: broken'
+    call = tests_['fail']['call']
+    assert 'longrepr' not in call
+    assert 'assert False' in failures[call['failure']]['longrepr']
+    assert 'failure' in tests_['xfail']['call']
+    setup = tests_['skip']['setup']
+    assert 'failure' not in setup
+    assert 'skipped' in setup['longrepr']
+    assert not any('skipped' in f['longrepr'] for f in failures.values())
+
+
+def test_capture_limits(make_json, num_processes):
+    data = make_json("""
+        import logging
+        def test_foo():
+            print('a' * 100 + 'b' * 100)
+            for i in range(10):
+                logging.error('log %d', i)
+            assert False, 'x' * 1000
+        def test_utf8():
+            print(u'\\xe4' * 100)
+    """, ['--json-report', '-n=%d' % num_processes,
+          '--json-report-max-stream-size=20',
+          '--json-report-max-log-records=5',
+          '--json-report-max-longrepr-size=100'])
+    tests_ = tests_only(data)
+    call = tests_['foo']['call']
+    assert call['stdout'] == \
+        'a' * 10 + '\n[... 181 bytes truncated ...]\n' + 'b' * 9 + '\n'
+    assert [r['msg'] for r in call['log']] == [
+        'log 0', 'log 1', 'log 2', 'log 8', 'log 9']
+    assert '[... ' in call['longrepr']
+    assert call['truncated']['stdout'] == 181
+    assert call['truncated']['log'] == 5
+    assert call['truncated']['longrepr'] > 900
+    assert 'truncated' not in tests_['foo']['setup']
+    # Sizes are counted in bytes, without splitting characters
+    call = tests_['utf8']['call']
+    assert call['stdout'] == \
+        '\xe4' * 5 + '\n[... 182 bytes truncated ...]\n' + '\xe4' * 4 + '\n'
+
+
+def test_capture_budget(testdir):
+    testdir.makepyfile("""
+        def test_first():
+            print('a' * 100)
+        def test_second():
+            print('b' * 100)
+        def test_third():
+            print('c' * 100)
+    """)
+    testdir.runpytest('--json-report', '--json-report-max-capture-size=150')
+    with open(str(testdir.tmpdir / '.report.json')) as f:
+        tests_ = [t['call'] for t in json.load(f)['tests']]
+    assert tests_[0]['stdout'] == 'a' * 100 + '\n'
+    assert 'truncated' not in tests_[0]
+    assert tests_[1]['truncated'] == {'stdout': 52}
+    assert tests_[2]['truncated'] == {'stdout': 101}
+
+    testdir.makepyfile("""
+        import logging
+        def test_first():
+            for i in range(4):
+                logging.error('first %d', i)
+        def test_second():
+            for i in range(4):
+                logging.error('second %d', i)
+    """)
+    testdir.runpytest('--json-report',
+                      '--json-report-max-session-log-records=6')
+    with open(str(testdir.tmpdir / '.report.json')) as f:
+        tests_ = [t['call'] for t in json.load(f)['tests']]
+    assert len(tests_[0]['log']) == 4
+    assert [r['msg'] for r in tests_[1]['log']] == ['second 0', 'second 3']
+    assert tests_[1]['truncated'] == {'log': 2}
+
+    # The output of passing tests doesn't count if it's dropped
+    testdir.makepyfile("""
+        import logging
+        def test_pass():
+            print('a' * 200)
+            for i in range(4):
+                logging.error('pass %d', i)
+        def test_fail():
+            print('b' * 100)
+            for i in range(4):
+                logging.error('fail %d', i)
+            assert False
+    """)
+    testdir.runpytest('--json-report', '--json-report-max-capture-size=150',
+                      '--json-report-max-session-log-records=4',
+                      '--json-report-details=failed')
+    with open(str(testdir.tmpdir / '.report.json')) as f:
+        tests_ = [t['call'] for t in json.load(f)['tests']]
+    assert 'stdout' not in tests_[0]
+    assert tests_[1]['stdout'] == 'b' * 100 + '\n'
+    assert len(tests_[1]['log']) == 4
 
 
 def test_report_streams(tests):
@@ -430,6 +774,38 @@ def test_warnings(make_json, num_processes):
     assert '__init__' in warnings[0]['message']
 
 
+@pytest.mark.parametrize('stream', [False, True])
+def test_aggregate_warnings(make_json, num_processes, stream):
+    args = ['--json-report', '-n=%d' % num_processes,
+            '--json-report-aggregate-warnings=2']
+    if stream:
+        args.append('--json-report-stream')
+    data = make_json("""
+        import warnings
+        import pytest
+
+        @pytest.mark.parametrize('n', range(3))
+        def test_warn(n):
+            for _ in range(100):
+                warnings.warn('hot loop', DeprecationWarning)
+            if n == 0:
+                warnings.warn('other', UserWarning)
+    """, args, parse=not stream)
+    if stream:
+        warnings = [r for r in map(json.loads, data.splitlines()) if
+                    r.pop('type') == 'warning']
+    else:
+        warnings = data['warnings']
+    warnings = {w['message']: w for w in warnings}
+    assert set(warnings) == {'hot loop', 'other'}
+    assert warnings['hot loop']['count'] == 300
+    assert warnings['hot loop']['category'] == 'DeprecationWarning'
+    assert len(warnings['hot loop']['nodeids']) == 2
+    assert warnings['other']['count'] == 1
+    assert warnings['other']['nodeids'] == [
+        'test_aggregate_warnings.py::test_warn[0]']
+
+
 def test_process_report(testdir, make_json):
     testdir.makeconftest("""
         def pytest_sessionfinish(session):
@@ -482,6 +858,94 @@ def test_logging(make_json):
     assert record.getMessage() == record.msg == 'log debug'
 
 
+def test_log_level(make_json):
+    data = make_json("""
+        import logging
+        def test_foo():
+            logging.info('log info')
+            logging.warning('log warning')
+            logging.error('log error')
+    """, ['--json-report', '--log-level=DEBUG',
+          '--json-report-log-level=warning'])
+    log = data['tests'][0]['call']['log']
+    assert [r['msg'] for r in log] == ['log warning', 'log error']
+
+
+def test_log_fields(make_json, num_processes):
+    code = """
+        import logging
+        def test_foo():
+            logging.getLogger('foo').error('log %s', 'error', exc_info=True)
+    """
+    data = make_json(code, ['--json-report', '-n=%d' % num_processes,
+                            '--json-report-log-fields=compact'])
+    record = data['tests'][0]['call']['log'][0]
+    assert set(record) == {
+        'name', 'msg', 'levelname', 'created', 'filename', 'lineno'}
+    assert record['msg'] == 'log error'
+    assert record['name'] == 'foo'
+
+    data = make_json(code, ['--json-report', '-n=%d' % num_processes,
+                            '--json-report-log-fields', 'msg', 'exc_info',
+                            'nonexistent', 'msg'])
+    assert data['tests'][0]['call']['log'] == [
+        {'msg': 'log error', 'exc_info': None, 'nonexistent': None}]
+
+
+@pytest.mark.parametrize('collapse, expected', [
+    ('consecutive', [('poll', 3), ('ready', 1), ('poll', 2)]),
+    ('all', [('poll', 5), ('ready', 1)]),
+])
+@pytest.mark.parametrize('fields', ['full', 'compact'])
+def test_collapse_logs(make_json, num_processes, collapse, expected, fields):
+    data = make_json("""
+        import logging
+        def test_foo():
+            for msg in ['poll'] * 3 + ['ready'] + ['poll'] * 2:
+                logging.info('%s', msg)
+            logging.getLogger('other').info('ready')
+    """, ['--json-report', '-n=%d' % num_processes, '--log-level=INFO',
+          '--json-report-collapse-logs=' + collapse,
+          '--json-report-log-fields=' + fields])
+    log = data['tests'][0]['call']['log']
+    assert [(r['msg'], r.get('repeat_count', 1)) for r in log[:-1]] == \
+        expected
+    assert log[-1]['name'] == 'other'
+    for record in log:
+        if 'repeat_count' in record:
+            assert record['last_created'] >= record['created']
+        else:
+            assert 'last_created' not in record
+
+
+def test_log_handler_removed(testdir):
+    test_file = testdir.makepyfile("""
+        import logging
+        def test_foo():
+            logging.error('log error')
+    """)
+    handlers = list(logging.getLogger().handlers)
+    plugin = JSONReport()
+    pytest.main([test_file.strpath], plugins=[plugin])
+    assert logging.getLogger().handlers == handlers
+    assert plugin.report['tests'][0]['call']['log'][0]['msg'] == 'log error'
+
+
+def test_log_handler_readded(make_json):
+    data = make_json("""
+        import logging
+        import logging.config
+
+        def test_configure():
+            logging.config.dictConfig({'version': 1, 'root': {'level': 'INFO'}})
+
+        def test_log():
+            logging.error('log error')
+    """, ['--json-report'])
+    assert [r['msg'] for r in data['tests'][1]['call']['log']] == \
+        ['log error']
+
+
 def test_no_logs(make_json):
     data = make_json("""
         import logging
@@ -551,6 +1015,504 @@ def test_xdist(make_json, match_reports):
     assert match_reports(r2, r3)
 
 
+def test_disk_store(make_json, match_reports):
+    r1 = make_json(FILE, ['--json-report'])
+    r2 = make_json(FILE, ['--json-report', '--json-report-store=disk'])
+    r3 = make_json(FILE, ['--json-report', '--json-report-store=disk',
+                          '--json-report-indent=2'])
+    assert match_reports(r1, r2)
+    assert match_reports(r2, r3)
+
+
+def test_disk_store_reopen():
+    store = DiskTestStore()
+    store.add('a', {'nodeid': 'a', 'outcome': 'passed'})
+    store.add('b', {'nodeid': 'b', 'outcome': 'failed'})
+    store.finish('a')
+    store.finish('b')
+    # A finished test may be continued, e.g. when it's rerun
+    store.get('a')['outcome'] = 'rerun'
+    store.finish('a')
+    assert list(store) == ['a', 'b']
+    assert sorted(store.outcomes()) == ['failed', 'rerun']
+    assert [t['outcome'] for t in store.tests()] == ['rerun', 'failed']
+
+
+@pytest.mark.parametrize('indent', [None, 2])
+def test_disk_store_encoded(indent):
+    encoder = StdlibEncoder()
+    store = DiskTestStore(encoder, indent=indent)
+    for nodeid in 'ab':
+        store.add(nodeid, {'nodeid': nodeid, 'outcome': 'passed'})
+    store.finish('a')
+    # Finished tests are written as they're stored
+    tests = store.tests().encoded(encoder, indent)
+    assert [type(test).__name__ for test in tests] == ['EncodedTest', 'dict']
+    f = io.BytesIO()
+    dump_report({'tests': tests}, f, indent=indent, encoder=encoder)
+    assert f.getvalue().decode() == json.dumps(
+        {'tests': list(store.tests())}, indent=indent)
+    # Decoded if the indentation differs
+    assert all(isinstance(test, dict) for test in
+               store.tests().encoded(encoder, 4))
+
+
+def test_disk_store_background_writer():
+    writer = BackgroundWriter(max_pending=1)
+    store = DiskTestStore(writer=writer)
+    for nodeid in 'abc':
+        store.add(nodeid, {'nodeid': nodeid, 'outcome': 'passed'})
+        store.finish(nodeid)
+    # Continued before or after it's written
+    store.get('a')['outcome'] = 'rerun'
+    store.finish('a')
+    writer.flush()
+    store.get('b')['outcome'] = 'failed'
+    writer.close()
+    assert [t['outcome'] for t in store.tests()] == \
+        ['rerun', 'failed', 'passed']
+
+    writer = BackgroundWriter()
+    writer.submit(operator.truediv, 1, 0)
+    with pytest.raises(ZeroDivisionError):
+        writer.flush()
+    writer.close()
+
+
+def test_async(make_json, match_reports, testdir, num_processes):
+    args = ['--json-report', '-n=%d' % num_processes, '--json-report-async']
+    r1 = make_json(FILE, args[:2])
+    r2 = make_json(FILE, args + ['--json-report-store=disk',
+                                 '--json-report-xdist-shards',
+                                 '--json-report-sqlite=report.db'])
+    assert match_reports(r1, r2)
+    conn = sqlite3.connect(str(testdir.tmpdir / 'report.db'))
+    assert dict(conn.execute('SELECT nodeid, outcome FROM tests')) == {
+        test['nodeid']: test['outcome'] for test in r1['tests']}
+    conn.close()
+    data = make_json(FILE, args + ['--json-report-stream'], parse=False)
+    records = [json.loads(line) for line in data.splitlines()]
+    assert records[-1]['summary'] == r1['summary']
+    assert len([r for r in records if r['type'] == 'test']) == \
+        len(r1['tests'])
+
+
+@pytest.mark.parametrize('indent', [None, 0, 4])
+def test_dump_report(indent):
+    report = {
+        'summary': {'passed': 1},
+        'tests': [{'nodeid': 'a', 'keywords': ['x', 'y']}, {'nodeid': 'b'}],
+        'warnings': [],
+    }
+    expected = json.dumps(report, indent=indent)
+    for lazy in (False, True):
+        f = io.BytesIO()
+        dump_report(dict(report, tests=iter(report['tests']),
+                         warnings=iter([])) if lazy else report, f, indent)
+        assert f.getvalue().decode('utf-8') == expected
+
+
+@pytest.mark.parametrize('encoder', ['orjson', 'auto'])
+def test_encoder(make_json, match_reports, encoder):
+    pytest.importorskip('orjson')
+    r1 = make_json(FILE, ['--json-report'])
+    r2 = make_json(FILE, ['--json-report', '--json-report-encoder=' + encoder])
+    r3 = make_json(FILE, ['--json-report', '--json-report-encoder=' + encoder,
+                          '--json-report-indent=2'])
+    assert match_reports(r1, r2)
+    assert match_reports(r2, r3)
+
+
+def test_encoder_fallback(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'ujson', None)
+    with pytest.warns(UserWarning, match='not installed'):
+        encoder = get_encoder('ujson')
+    assert encoder.name == 'stdlib'
+
+
+@pytest.mark.parametrize('name', list(ENCODERS))
+def test_encoder_semantics(name):
+    try:
+        encoder = ENCODERS[name]()
+    except ImportError:
+        pytest.skip('{} is not installed'.format(name))
+    obj = {'a': [1, 2 ** 70], 'b': object, 1: None}
+    assert json.loads(encoder.dumps(obj)) == \
+        {'a': [1, 2 ** 70], 'b': str(object), '1': None}
+    assert encoder.serializable({'a': [1, 2 ** 70]})
+    assert not encoder.serializable({'a': object()})
+    # Enums and non-finite floats are encoded like the stdlib does it
+    Color = enum.Enum('Color', 'RED')
+    assert json.loads(encoder.dumps([Color.RED, enum.IntEnum('N', 'A').A])) \
+        == ['Color.RED', 1]
+    assert not encoder.serializable({'a': [Color.RED]})
+    for indent in (None, 2):
+        data = encoder.dumps({'a': [1.5, float('nan'), float('-inf')]},
+                             indent=indent)
+        assert b'NaN' in data and b'-Infinity' in data
+
+
+def test_serializable():
+    encoder = StdlibEncoder()
+    shared = [1.5, 'x']
+    cyclic = {'a': [True, None]}
+    cyclic['a'].append(cyclic)
+    for obj in ({'a': (1, 2.5), 1.5: None, None: 'x'}, [shared, shared],
+                cyclic, {'a': {'b': [set()]}}, {(1, 2): 'a'}, [b'a']):
+        try:
+            json.dumps(obj)
+        except (TypeError, ValueError):
+            expected = False
+        else:
+            expected = True
+        assert encoder.serializable(obj) == expected
+
+
+@pytest.mark.parametrize('fsync', [False, True])
+def test_atomic_report_file(tmpdir, fsync):
+    path = str(tmpdir / 'report.json')
+    with atomic_report_file(path, fsync) as f:
+        f.write(b'{}')
+    with pytest.raises(ZeroDivisionError):
+        with atomic_report_file(path, fsync) as f:
+            f.write(b'{"partial": ')
+            assert os.listdir(str(tmpdir)) != ['report.json']
+            1 / 0
+    assert os.listdir(str(tmpdir)) == ['report.json']
+    with open(path) as f:
+        assert f.read() == '{}'
+
+
+@pytest.mark.parametrize('suffix, module', [
+    ('.gz', 'gzip'), ('.bz2', 'bz2'), ('.xz', 'lzma')])
+def test_compressed_report(misc_testdir, suffix, module):
+    module = pytest.importorskip(module)
+    path = misc_testdir.tmpdir / ('report.json' + suffix)
+    misc_testdir.runpytest('--json-report', '--json-report-file=' + str(path))
+    with module.open(str(path), 'rt') as f:
+        data = json.load(f)
+    assert data['summary']['total'] == 10
+    if suffix == '.gz':
+        # The header names the original file (not the temporary one) after
+        # the first 10 bytes
+        header = path.read_binary()[:100]
+        assert header[10:].split(b'\0')[0] == b'report.json'
+
+    misc_testdir.runpytest('--json-report', '--json-report-stream',
+                           '--json-report-file=' + str(path))
+    with module.open(str(path), 'rt') as f:
+        records = [json.loads(line) for line in f]
+    assert records[-1]['summary']['total'] == 10
+
+
+def test_compact(make_json, match_reports):
+    r1 = make_json(FILE, ['--json-report'])
+    r2 = make_json(FILE, ['--json-report', '--json-report-compact',
+                          '--json-report-dedupe-failures'])
+    assert 'strings' in r2
+    test = r2['tests'][0]
+    assert isinstance(test['nodeid'], list)
+    assert all(isinstance(k, int) for k in test['keywords'])
+    r2 = expand_report(r2)
+    for test in r2['tests']:
+        for stage in ('setup', 'call', 'teardown'):
+            if 'failure' in test.get(stage, {}):
+                test[stage].update(r2['failures'][test[stage].pop('failure')])
+    del r2['failures']
+    assert match_reports(r1, r2)
+    assert normalize_report(r1)['tests'] == normalize_report(r2)['tests']
+
+
+def test_compact_stream(make_json):
+    data = make_json(FILE, ['--json-report', '--json-report-stream',
+                            '--json-report-compact'], parse=False)
+    strings = []
+    tests_ = []
+    for line in data.splitlines():
+        record = json.loads(line)
+        type_ = record.pop('type')
+        if type_ == 'strings':
+            strings.extend(record['strings'])
+        elif type_ == 'test':
+            tests_.append(expand_record(type_, record, strings))
+    assert len(strings) == len(set(strings))
+    assert tests_[0]['nodeid'] == 'test_compact_stream.py::test_pass'
+    assert tests_[0]['keywords'][0] == 'test_pass'
+
+
+def test_profile(testdir, num_processes):
+    testdir.makepyfile(FILE)
+    res = testdir.runpytest('--json-report', '-n=%d' % num_processes,
+                            '--json-report-profile')
+    res.stdout.fnmatch_lines(['plugin overhead: *s (*us per test)',
+                              '*pytest_runtest_logreport*calls*s'])
+    with open(str(testdir.tmpdir / '.report.json')) as f:
+        data = json.load(f)
+    stats = data['plugin_stats']
+    num_stages = sum(stage in test for test in data['tests'] for stage in
+                     ('setup', 'call', 'teardown'))
+    assert stats['pytest_runtest_logreport']['calls'] == num_stages
+    # Measured on the workers with xdist
+    assert stats['pytest_runtest_makereport']['calls'] == num_stages
+    for stat in stats.values():
+        assert 0 <= stat['self_time'] <= stat['total_time']
+
+
+def test_profile_threads():
+    stats = PluginStats()
+    # E.g. a log record emitted on another thread during a hook
+    thread = threading.Thread(target=stats.wrap('emit', time.sleep),
+                              args=(0.1,))
+    with stats.measure('hook'):
+        thread.start()
+        thread.join()
+    result = stats.to_dict()
+    assert result['emit']['self_time'] >= 0.1
+    assert result['hook']['self_time'] == result['hook']['total_time']
+
+
+@pytest.mark.parametrize('compact', [False, True])
+@pytest.mark.parametrize('streamed', [False, True])
+def test_iter_records(make_json, tmpdir, monkeypatch, streamed, compact):
+    data = make_json()
+    lists = {'collectors': 'collector', 'tests': 'test', 'warnings': 'warning'}
+    path = str(tmpdir / 'report.json.gz')
+    if streamed:
+        writer = StreamWriter(path, compact=compact)
+        for key, type_ in lists.items():
+            for record in data.get(key, []):
+                writer.write(type_, record)
+        writer.write('summary', {key: val for key, val in data.items() if
+                                 key not in lists})
+        writer.close()
+    else:
+        with open_report_file(path, 'wb') as f:
+            dump_report(compact_report(data) if compact else data, f)
+    # Make values span multiple chunks
+    monkeypatch.setattr(reader, 'CHUNK_SIZE', 10)
+    records = list(reader.iter_records(path))
+    for key, type_ in lists.items():
+        assert [r for t, r in records if t == type_] == data.get(key, [])
+    assert records[-1] == ('summary', {key: val for key, val in data.items()
+                                       if key not in lists})
+
+
+@pytest.mark.parametrize('suffix', ['.gz', '.xz'])
+def test_iter_records_cut_off(tmpdir, suffix):
+    path = str(tmpdir / ('report.jsonl' + suffix))
+    writer = StreamWriter(path)
+    writer.write('header', {'start': 0})
+    for i in range(1000):
+        writer.write('test', {'nodeid': 'test_%d' % i, 'outcome': 'passed'})
+    writer.close()
+    # Like a session which got killed while writing
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path, 'wb') as f:
+        f.write(data[:len(data) // 2])
+    nodeids = [test['nodeid'] for test in reader.iter_tests(path)]
+    assert 0 < len(nodeids) < 1000
+    assert nodeids == ['test_%d' % i for i in range(len(nodeids))]
+
+
+def test_iter_tests(testdir):
+    testdir.makepyfile(FILE)
+    testdir.runpytest('--json-report', '--json-report-file=report.json.gz')
+    path = str(testdir.tmpdir / 'report.json.gz')
+    failed = list(reader.iter_tests(path, outcome='failed'))
+    assert failed and all(t['outcome'] == 'failed' for t in failed)
+    nodeids = [t['nodeid'] for t in
+               reader.iter_tests(path, outcome=('passed', 'skipped'),
+                                 nodeid_prefix='test_iter_tests.py::test_pa')]
+    assert nodeids == ['test_iter_tests.py::test_pass',
+                       'test_iter_tests.py::test_parametrized[1]']
+    assert [c['nodeid'] for c in reader.iter_collectors(
+        path, nodeid_prefix='test_iter')] == ['test_iter_tests.py']
+
+
+@pytest.mark.parametrize('indent', [None, 2])
+def test_index(misc_testdir, indent):
+    args = ['--json-report', '--json-report-index', '--json-report-fsync']
+    if indent is not None:
+        args.append('--json-report-indent=%d' % indent)
+    misc_testdir.runpytest(*args)
+    path = str(misc_testdir.tmpdir / '.report.json')
+    with open(path) as f:
+        data = json.load(f)
+    with ReportIndex(path) as index:
+        for test in data['tests']:
+            assert index[test['nodeid']] == test
+            assert index.outcome(test['nodeid']) == test['outcome']
+        assert list(index.nodeids()) == sorted(
+            test['nodeid'] for test in data['tests'])
+        assert 'test_index.py::test_foo' not in index
+        assert index.get('test_index.py::test_foo') is None
+    # The index is stale once the report has been replaced
+    misc_testdir.runpytest('--json-report')
+    with pytest.raises(ValueError):
+        ReportIndex(path)
+
+
+def test_sqlite(make_json, testdir, num_processes):
+    data = make_json(FILE, ['--json-report', '-n=%d' % num_processes,
+                            '--json-report-sqlite=report.db'])
+    conn = sqlite3.connect(str(testdir.tmpdir / 'report.db'))
+    (session_id, exitcode, summary), = conn.execute(
+        'SELECT id, exitcode, summary FROM sessions')
+    assert exitcode == data['exitcode']
+    assert json.loads(summary) == data['summary']
+    tests_ = {test['nodeid']: test for test in data['tests']}
+    rows = conn.execute('SELECT nodeid, outcome FROM tests')
+    assert dict(rows) == {
+        nodeid: test['outcome'] for nodeid, test in tests_.items()}
+    (stdout,), = conn.execute(
+        'SELECT stages.stdout FROM stages JOIN tests ON tests.id = test_id '
+        'WHERE nodeid LIKE ? AND stage = ?',
+        ('%test_fail_with_fixture', 'call'))
+    assert stdout == 'call\n'
+    num_logs, = conn.execute('SELECT COUNT(*) FROM logs').fetchone()
+    assert num_logs == sum(len(test.get(when, {}).get('log', [])) for
+                           test in data['tests'] for when in ('setup', 'call',
+                                                              'teardown'))
+
+    # Sessions are added to existing databases
+    testdir.runpytest('--json-report', '--json-report-sqlite=report.db')
+    assert conn.execute('SELECT COUNT(*) FROM sessions').fetchone()[0] == 2
+    conn.close()
+
+    # The report is still saved if the database can't be opened
+    os.remove(str(testdir.tmpdir / '.report.json'))
+    res = testdir.runpytest('--json-report', '--json-report-sqlite=.')
+    assert res.ret == 1
+    res.stdout.fnmatch_lines(['*could not open SQLite database: *'])
+    assert (testdir.tmpdir / '.report.json').exists()
+
+
+@pytest.mark.parametrize('args', [[], ['--json-report-async']])
+def test_sqlite_locked(testdir, monkeypatch, args):
+    monkeypatch.setattr('pytest_jsonreport.sqlite.LOCK_TIMEOUT', 0.1)
+    monkeypatch.setattr('pytest_jsonreport.sqlite.BATCH_SIZE', 1)
+    testdir.makepyfile("""
+        import sqlite3
+
+        def test_lock():
+            global conn
+            conn = sqlite3.connect('report.db', isolation_level=None)
+            conn.execute('BEGIN EXCLUSIVE')
+
+        def test_pass():
+            pass
+    """)
+    res = testdir.runpytest('--json-report', '--json-report-sqlite=report.db',
+                            *args)
+    assert res.ret == 0
+    res.stdout.fnmatch_lines([
+        '*could not write to SQLite database: database is locked*'])
+    # The report is still saved
+    with open(str(testdir.tmpdir / '.report.json')) as f:
+        assert json.load(f)['summary']['passed'] == 2
+
+
+def test_sqlite_concurrent_sessions(tmpdir):
+    path = str(tmpdir / 'report.db')
+    writers = [SQLiteWriter(path), SQLiteWriter(path)]
+    for writer in writers:
+        writer.add_test({
+            'nodeid': 'test_foo', 'outcome': 'passed',
+            'call': {'duration': 1, 'log': [{'msg': 'foo'}]}})
+    for writer in writers:
+        writer.flush()
+        writer.close({})
+    conn = sqlite3.connect(path)
+    assert conn.execute(
+        'SELECT COUNT(DISTINCT session_id) FROM tests JOIN stages ON '
+        'tests.id = test_id JOIN logs ON stages.id = stage_id').fetchone() == \
+        (2,)
+    conn.close()
+
+
+def test_columnar(make_json, testdir, num_processes):
+    data = make_json(FILE, ['--json-report', '-n=%d' % num_processes,
+                            '--json-report-columnar=columns.npz'])
+    live = load_columns(str(testdir.tmpdir / 'columns.npz'))
+    assert main(['columnar', '-o', 'exported.npz', '.report.json',
+                 '.report.json']) == 0
+    exported = load_columns(str(testdir.tmpdir / 'exported.npz'))
+
+    assert len(live['runs']) == 1
+    assert live['runs'][0] <= data['created']
+    assert sorted(live['nodeids']) == sorted(
+        test['nodeid'] for test in data['tests'])
+    for columns in live, exported:
+        for i, nodeid in enumerate(columns['nodeid']):
+            test = next(test for test in data['tests'] if
+                        test['nodeid'] == columns['nodeids'][nodeid])
+            assert columns['outcomes'][columns['outcome'][i]] == \
+                test['outcome']
+            assert columns['call'][i] == test['call']['duration'] if \
+                'call' in test else columns['call'][i] != columns['call'][i]
+    assert list(exported['run']) == [0] * len(data['tests']) + \
+        [1] * len(data['tests'])
+
+
+def test_columnar_numpy(tmpdir):
+    numpy = pytest.importorskip('numpy')
+    columns = Columns()
+    columns.add_run(100)
+    columns.add_test({'nodeid': 'a', 'outcome': 'passed',
+                      'setup': {'duration': 1}, 'call': {'duration': 2}})
+    columns.add_test({'nodeid': 'b', 'outcome': 'error',
+                      'setup': {'duration': 3}}, start=105)
+    path = str(tmpdir / 'columns.npz')
+    columns.save(path)
+    arrays = numpy.load(path)
+    assert list(arrays['nodeids']) == ['a', 'b']
+    assert list(arrays['outcome']) == [0, 1]
+    assert list(arrays['setup']) == [1, 3]
+    assert numpy.isnan(arrays['call'][1])
+    assert numpy.isnan(arrays['start'][0]) and arrays['start'][1] == 105
+    assert list(arrays['runs']) == [100]
+
+
+def test_merge(tmpdir):
+    def make_report(created, exitcode, outcomes):
+        return {
+            'created': created,
+            'duration': 10,
+            'exitcode': exitcode,
+            'root': '/',
+            'environment': {},
+            'summary': {'collected': len(outcomes)},
+            'collectors': [{'nodeid': '', 'outcome': 'passed', 'result': []}],
+            'tests': [{'nodeid': nodeid, 'outcome': outcome} for
+                      nodeid, outcome in outcomes],
+            'warnings': [{'message': 'foo', 'when': 'runtest'}],
+        }
+
+    report1 = make_report(100, 1, [('a', 'failed'), ('b', 'passed')])
+    report2 = make_report(105, 5, [])
+    report3 = make_report(103, 0, [('a', 'passed'), ('c', 'passed')])
+    paths = [str(tmpdir / name) for name in
+             ('1.json', '2.json', '3.json.gz', 'merged.json')]
+    for path, report in zip(paths, [report1, report2, report3]):
+        with open_report_file(path, 'wb') as f:
+            dump_report(compact_report(report), f)
+    assert main(['merge', '-o', paths[-1]] + paths[:-1]) == 0
+
+    with open(paths[-1]) as f:
+        merged = json.load(f)
+    assert merged['created'] == 105
+    assert merged['duration'] == 15
+    assert merged['exitcode'] == 1
+    assert merged['summary'] == {
+        'passed': 3, 'total': 3, 'collected': 4}
+    assert merged['tests'] == [{'nodeid': 'b', 'outcome': 'passed'},
+                               {'nodeid': 'a', 'outcome': 'passed'},
+                               {'nodeid': 'c', 'outcome': 'passed'}]
+    assert len(merged['collectors']) == 1
+    assert len(merged['warnings']) == 3
+
+
 def test_bug_31(make_json):
     data = make_json('''
         from flaky import flaky